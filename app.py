@@ -1,132 +1,478 @@
-import uuid
-from flask import Flask, request
+import hmac
+import os
+import time
+from functools import wraps
+from eventlet import tpool
+from eventlet.semaphore import Semaphore
+from flask import Flask, abort, request
 from flask_socketio import SocketIO, emit, join_room, leave_room
 
 # Import the refactored game logic
 from ksh_game import GameState
+from ksh_engine import DEFAULT_TABLE_BYTES, configure_shared_table, find_best_move, get_shared_table
+from ksh_protocol import PayloadJSON, StateTracker
+from ksh_sessions import AlreadySeated, GameNotFound, SeatTaken, SessionRegistry
+from ksh_store import GameStore, SQLiteGameStore
+from ksh_logging import (
+    click_sampled, configure_logging, get_logger, logging_settings, set_click_sample_rate, set_level,
+)
+from ksh_metrics import CONTENT_TYPE, REGISTRY, counter, gauge, histogram, instrument_game
+from ksh_profiling import PROFILER, profiling_active, sample_game
+
+configure_logging(os.environ.get('KSH_LOG_LEVEL', 'INFO'), float(os.environ.get('KSH_CLICK_LOG_SAMPLE', '0.01')))
+logger = get_logger('app')
+
+# Handler latency is labelled by outcome; for handle_click that is the kind of click
+# (select, move, deselect, denied, ...), which is what tells the slow clicks apart.
+HANDLER_SECONDS = histogram('ksh_handler_seconds', "Socket.IO handler latency.", ('event', 'outcome'))
+SERIALIZE_SECONDS = histogram('ksh_serialize_seconds', "Time spent building state payloads and encoding packets.", ('stage',))
+CONNECTED_SIDS = gauge('ksh_connected_sids', "Connected Socket.IO clients.")
+
+class MeteredPayloadJSON(PayloadJSON):
+    """PayloadJSON that times every packet it encodes."""
+
+    @staticmethod
+    def dumps(*args, **kwargs):
+        with SERIALIZE_SECONDS.time('encode'):
+            return PayloadJSON.dumps(*args, **kwargs)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'a_very_secret_key_that_should_be_changed'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
-
-game_sessions = {}
-
-def get_game_state_for_frontend(game_state):
-    """Prepares a JSON-serializable version of the game state for the client."""
-    board_for_frontend = []
-    for r_idx, row in enumerate(game_state.board_state):
-        row_for_frontend = []
-        for c_idx, piece in enumerate(row):
-            if piece:
-                is_deactivated = False
-                if piece.general_group and piece.general_group != '중앙' and piece.name != 'Su':
-                    group_key = f"{piece.team}_{piece.general_group}"
-                    if game_state.deactivated_groups.get(group_key, False):
-                        is_deactivated = True
-
-                row_for_frontend.append({
-                    "team": piece.team, "name": piece.name,
-                    "korean_name": piece.korean_name, "position": piece.position,
-                    "is_deactivated": is_deactivated,
-                })
-            else:
-                row_for_frontend.append(None)
-        board_for_frontend.append(row_for_frontend)
+# PayloadJSON lets snapshots carry their board pre-encoded (see ksh_protocol).
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', json=MeteredPayloadJSON)
+
+# Single-player games: the server plays '한' and takes this seat in session['players'].
+AI_TEAM = '한'
+AI_PLAYER_SID = 'AI'
+AI_TIME_BUDGET = float(os.environ.get('KSH_AI_TIME_BUDGET', '2.0'))
+# Every AI game shares one transposition table capped at this many bytes.
+configure_shared_table(int(os.environ.get('KSH_TT_MAX_BYTES', DEFAULT_TABLE_BYTES)))
+
+def _env_seconds(name, default):
+    """Seconds from the environment; 0 or a negative value disables the limit."""
+    value = float(os.environ.get(name, default))
+    return value if value > 0 else None
+
+# Games are saved to this SQLite file when KSH_STORE_PATH is set and reloaded on first use.
+store = SQLiteGameStore(os.environ['KSH_STORE_PATH']) if os.environ.get('KSH_STORE_PATH') else GameStore()
+
+# Clicks run their move generation and legality checks in eventlet's thread pool, so a
+# slow one does not stall every other connection. The pool (shared with the AI search)
+# has KSH_POOL_THREADS threads; KSH_CLICK_OFFLOAD=0 runs clicks on the hub instead.
+# A game queues at most KSH_GAME_QUEUE_DEPTH clicks, the server KSH_CLICK_BACKLOG.
+CLICK_OFFLOAD = os.environ.get('KSH_CLICK_OFFLOAD', '1') != '0'
+GAME_QUEUE_DEPTH = int(os.environ.get('KSH_GAME_QUEUE_DEPTH', 8))
+CLICK_BACKLOG = int(os.environ.get('KSH_CLICK_BACKLOG', 1000))
+if os.environ.get('KSH_POOL_THREADS'): tpool.set_num_threads(int(os.environ['KSH_POOL_THREADS']))
+_click_backlog = 0 # clicks queued or running, server-wide
+
+class GameLane:
+    """Serialises the work on one game. Clicks take their turn in arrival order while
+    the pool runs them, and hub code that reads or changes the game (snapshots, the AI's
+    move, takebacks, replay copies) holds the lane too, so it never sees a half-made move."""
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = Semaphore()
+        self.pending = 0 # clicks waiting for or holding the lane
 
+def run_click(game, pos):
+    return tpool.execute(game.handle_click, pos) if CLICK_OFFLOAD else game.handle_click(pos)
+
+# Compute every legal move of the side to move right after each move, so its selection
+# clicks are memo lookups (GameState.precompute_moves); costs a few ms per move.
+PRECOMPUTE_MOVES = os.environ.get('KSH_PRECOMPUTE_MOVES', '0') == '1'
+
+# Share of new or restored games profiled for their whole life (see ksh_profiling); 0 is off.
+profile_sample_rate = float(os.environ.get('KSH_PROFILE_SAMPLE', '0'))
+
+def new_session(game, vs_ai):
+    instrument_game(game)
+    sample_game(game, profile_sample_rate)
+    game.precompute_moves = PRECOMPUTE_MOVES
     return {
-        "board_state": board_for_frontend,
-        "current_turn": game_state.current_turn,
-        "game_over": game_state.game_over,
-        "winner": game_state.winner,
-        "valid_moves": game_state.valid_moves,
-        "deactivated_groups": game_state.deactivated_groups,
-        "in_check_team": game_state.in_check_team,
-        "checked_su_pos": game_state.checked_su_pos,
-        "selected_pos": game_state.selected_pos, # Add selected_pos to payload
-        "fen": game_state.generate_fen()
+        'game': game,
+        'players': {'초': None, '한': AI_PLAYER_SID if vs_ai else None},
+        'vs_ai': vs_ai,
+        'sync': StateTracker(),
+        'takeback': None, # team whose takeback request awaits the opponent's answer
+        'lane': GameLane(),
     }
 
-def get_player_team(sid, session):
-    for team, player_sid in session['players'].items():
-        if player_sid == sid:
-            return team
-    return None
+def load_session(game_id):
+    """Registry loader: brings a saved game back with every human seat free to rejoin."""
+    loaded = store.load_game(game_id)
+    if loaded is None: return None
+    logger.info("game restored from storage", extra={'fields': {'game_id': game_id}})
+    return new_session(*loaded)
+
+# Under ksh_router this process is worker KSH_SHARD of KSH_SHARDS and owns only the
+# game_ids that hash to it.
+SHARD = (int(os.environ.get('KSH_SHARD', 0)), int(os.environ.get('KSH_SHARDS', 1)))
+
+# Idle sessions are reaped per phase; the store as a whole is capped by game count and
+# estimated memory, evicting the least recently active games first.
+sessions = SessionRegistry(
+    ttls={
+        'waiting': _env_seconds('KSH_WAITING_TTL', 600),
+        'playing': _env_seconds('KSH_PLAYING_TTL', 1800),
+        'finished': _env_seconds('KSH_FINISHED_TTL', 300),
+    },
+    max_games=int(os.environ.get('KSH_MAX_GAMES', 20000)),
+    max_bytes=int(os.environ.get('KSH_MAX_SESSION_BYTES', 1 << 30)),
+    loader=load_session,
+    shard=SHARD,
+)
+gauge('ksh_active_games', "Game sessions in memory.", function=lambda: {(): len(sessions)})
+gauge('ksh_click_backlog', "Clicks queued or running.", function=lambda: {(): _click_backlog})
+gauge('ksh_move_history_bytes', "Memory held by the move histories of the games in memory.",
+      function=lambda: {(): sum(session['game'].move_history.nbytes() for _, session in sessions.sessions())})
+counter('ksh_session_evictions_total', "Sessions evicted from memory, by reason.", ('reason',),
+        function=lambda: {(reason,): count for reason, count in sessions.evictions.items()})
+gauge('ksh_transposition_table', "Shared AI transposition table statistics.", ('stat',),
+      function=lambda: {(stat,): value for stat, value in get_shared_table().stats().items()})
+
+REAPER_INTERVAL = float(os.environ.get('KSH_REAPER_INTERVAL', 30))
+_reaper_started = False
+
+# Replay viewers: sid -> (game_id, live game version it was copied at, GameState, StateTracker).
+replays = {}
+
+def instrumented(event):
+    """Records a handler's latency in HANDLER_SECONDS. The handler may return an outcome
+    label ('ok' if it returns nothing); nothing it returns is sent back as an ack."""
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                outcome = handler(*args, **kwargs) or 'ok'
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, event, outcome)
+        return wrapper
+    return decorator
+
+def state_snapshot(session, advance=True):
+    with session['lane'].lock, SERIALIZE_SECONDS.time('update_state'):
+        return session['sync'].snapshot(session['game'], advance)
+
+def broadcast_state(game_id, session):
+    """Sends the room whatever changed since its last update (a full snapshot the first time)."""
+    start = time.perf_counter()
+    event, payload = session['sync'].update(session['game'])
+    SERIALIZE_SECONDS.observe(time.perf_counter() - start, event)
+    socketio.emit(event, payload, room=game_id)
+
+def record_move(game_id, session):
+    """Bookkeeping after a move in the live game: log it and void any pending takeback request."""
+    store.record_move(game_id, session['game'])
+    session['takeback'] = None
+
+def takeback(game_id, session, team):
+    """Undoes moves until team's last move is taken back. Returns False if it has none to take back."""
+    game = session['game']
+    history = game.move_history
+    with session['lane'].lock:
+        count = next((n for n in (1, 2) if len(history) >= n and history[-n].team == team), None)
+        if count is None: return False
+        for _ in range(count):
+            game.undo()
+        store.record_undo(game_id, game, count)
+        session['takeback'] = None
+        sessions.touch(game_id)
+        broadcast_state(game_id, session)
+    return True
+
+def release_seat(vacated):
+    """Tells the opponent a player left their seat, or drops the game if no one is left to tell."""
+    if not vacated: return
+    game_id, team, session = vacated
+    other_team = '한' if team == '초' else '초'
+    remaining_player_sid = session['players'].get(other_team)
+    if remaining_player_sid and remaining_player_sid != AI_PLAYER_SID:
+        socketio.emit('player_disconnected', {'message': '상대방의 연결이 끊어졌습니다.'}, room=remaining_player_sid)
+    else:
+        sessions.remove(game_id)
+        store.delete_game(game_id)
+        logger.info("empty game removed", extra={'fields': {'game_id': game_id}})
+
+def close_sessions(evicted):
+    for game_id, session, reason in evicted:
+        socketio.emit('session_expired', {'message': '오랫동안 활동이 없어 게임이 종료되었습니다.', 'reason': reason}, room=game_id)
+        socketio.close_room(game_id)
+        # Games pushed out by the caps stay saved and reload on their next use.
+        if reason != 'capacity': store.delete_game(game_id)
+        logger.info("game evicted", extra={'fields': {'game_id': game_id, 'reason': reason}})
+
+def reap_sessions():
+    """Background task: periodically drops idle sessions and enforces the store caps."""
+    while True:
+        socketio.sleep(REAPER_INTERVAL)
+        close_sessions(sessions.reap())
 
 @app.route('/')
 def index():
-    return "KSH Game Backend is running. Active sessions: " + str(len(game_sessions))
+    return "KSH Game Backend is running. Active sessions: " + str(len(sessions))
+
+@app.route('/stats')
+def stats():
+    return sessions.stats()
+
+# Admin routes are off unless KSH_ADMIN_TOKEN is set; requests then send it as X-Admin-Token.
+ADMIN_TOKEN = os.environ.get('KSH_ADMIN_TOKEN')
+
+def admin_authorized():
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+@app.route('/admin/logging', methods=['GET', 'POST'])
+def admin_logging():
+    """Reads or changes the log level and the per-click debug sample rate of the running server."""
+    if not admin_authorized(): abort(404)
+    if request.method == 'POST':
+        settings = request.get_json(silent=True) or {}
+        try:
+            if 'level' in settings: set_level(settings['level'])
+            if 'click_sample_rate' in settings: set_click_sample_rate(settings['click_sample_rate'])
+        except (TypeError, ValueError) as e:
+            return {'error': str(e)}, 400
+        logger.info("logging settings changed", extra={'fields': logging_settings()})
+    return logging_settings()
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """Dumps the top GameState hot-path offenders (?limit=, ?sort=seconds|calls|per_call).
+
+    POST {'sample_rate': r} changes the share of new games profiled, {'game_id': id,
+    'enabled': bool} profiles or stops profiling one live game, and {'reset': true}
+    clears the counts.
+    """
+    global profile_sample_rate
+    if not admin_authorized(): abort(404)
+    if request.method == 'POST':
+        settings = request.get_json(silent=True) or {}
+        try:
+            if 'sample_rate' in settings: profile_sample_rate = min(max(float(settings['sample_rate']), 0.0), 1.0)
+        except (TypeError, ValueError) as e:
+            return {'error': str(e)}, 400
+        if 'game_id' in settings:
+            session = sessions.get(settings['game_id'])
+            if session is None: return {'error': 'unknown game'}, 404
+            if settings.get('enabled', True): PROFILER.attach(session['game'])
+            else: PROFILER.detach(session['game'])
+        if settings.get('reset'): PROFILER.reset()
+        logger.info("profiling settings changed", extra={'fields': {'sample_rate': profile_sample_rate, 'games': PROFILER.games}})
+    sort = request.args.get('sort', 'seconds')
+    if sort not in ('seconds', 'calls', 'per_call'): return {'error': f"unknown sort {sort!r}"}, 400
+    return {
+        'active': profiling_active(),
+        'games': PROFILER.games,
+        'sample_rate': profile_sample_rate,
+        'top': PROFILER.top(request.args.get('limit', 20, type=int), sort),
+    }
+
+@app.route('/metrics')
+def metrics():
+    return REGISTRY.render(), 200, {'Content-Type': CONTENT_TYPE}
 
 @socketio.on('connect')
-def on_connect():
-    print(f'Client connected: {request.sid}')
+@instrumented('connect')
+def on_connect(auth=None):
+    global _reaper_started
+    CONNECTED_SIDS.inc()
+    logger.info("client connected", extra={'fields': {'sid': request.sid}})
+    if not _reaper_started:
+        _reaper_started = True
+        socketio.start_background_task(reap_sessions)
 
 @socketio.on('disconnect')
-def on_disconnect():
-    print(f'Client disconnected: {request.sid}')
-    game_id_to_cleanup = None
-    for game_id, session in game_sessions.items():
-        disconnected_team = get_player_team(request.sid, session)
-        if disconnected_team:
-            session['players'][disconnected_team] = None
-            other_team = '한' if disconnected_team == '초' else '초'
-            remaining_player_sid = session['players'].get(other_team)
-            if remaining_player_sid:
-                emit('player_disconnected', {'message': '상대방의 연결이 끊어졌습니다.'}, room=remaining_player_sid)
-            else:
-                game_id_to_cleanup = game_id
-            break
-    if game_id_to_cleanup:
-        del game_sessions[game_id_to_cleanup]
-        print(f"Removed empty game session: {game_id_to_cleanup}")
+@instrumented('disconnect')
+def on_disconnect(reason=None):
+    CONNECTED_SIDS.dec()
+    logger.info("client disconnected", extra={'fields': {'sid': request.sid}})
+    replays.pop(request.sid, None)
+    release_seat(sessions.leave(request.sid))
+
+def play_ai_move(game_id):
+    """Background task: search off the eventlet hub, then play the move if the position is unchanged."""
+    session = sessions.get(game_id)
+    if not session: return
+    game = session['game']
+    with session['lane'].lock:
+        position_key = game.zobrist_key
+        search_copy = game.copy()
+    result = tpool.execute(find_best_move, search_copy, AI_TIME_BUDGET)
+
+    session = sessions.get(game_id)
+    if not session or session['game'] is not game: return
+    with session['lane'].lock:
+        if game.game_over or game.current_turn != AI_TEAM or game.zobrist_key != position_key: return
+        if result.best_move is None: return
+        game.move_piece(*result.best_move)
+        record_move(game_id, session)
+        sessions.touch(game_id)
+        broadcast_state(game_id, session)
+    if game.game_over:
+        socketio.emit('game_over', {'winner': game.winner, 'reason': game.end_reason}, room=game_id)
 
 @socketio.on('create_game')
-def on_create_game():
+@instrumented('create_game')
+def on_create_game(data=None):
     player_sid = request.sid
-    game_id = str(uuid.uuid4().hex)[:6]
+    vs_ai = bool(data and data.get('vs_ai'))
     game = GameState()
-    game_sessions[game_id] = {
-        'game': game,
-        'players': {'초': player_sid, '한': None}
-    }
+    session = new_session(game, vs_ai)
+    game_id, vacated = sessions.create(session, player_sid, '초',
+                                       claim=lambda game_id: store.create_game(game_id, game, vs_ai))
+    if vacated: leave_room(vacated[0])
+    release_seat(vacated)
+    close_sessions(sessions.enforce_caps())
     join_room(game_id)
-    print(f"Player {player_sid} created game {game_id} as team '초'")
-    emit('game_created', {'game_id': game_id})
-    emit('update_state', get_game_state_for_frontend(game))
+    logger.info("game created", extra={'fields': {'game_id': game_id, 'sid': player_sid, 'team': '초', 'vs_ai': vs_ai}})
+    emit('game_created', {'game_id': game_id, 'vs_ai': vs_ai})
+    if vs_ai:
+        emit('game_started', {'message': 'AI와의 게임을 시작합니다!'})
+    emit('update_state', state_snapshot(session))
 
 @socketio.on('join_game')
+@instrumented('join_game')
 def on_join_game(data):
     player_sid = request.sid
     game_id = data.get('game_id')
-    if game_id not in game_sessions:
+    try:
+        session, team, vacated = sessions.join(game_id, player_sid)
+    except GameNotFound:
         emit('error', {'message': '해당 ID의 게임을 찾을 수 없습니다.'})
-        return
-    session = game_sessions[game_id]
-    if session['players']['한'] is not None:
+        return 'not_found'
+    except SeatTaken:
         emit('error', {'message': '이 게임은 이미 가득 찼습니다.'})
-        return
-    if session['players']['초'] == player_sid:
+        return 'full'
+    except AlreadySeated:
         emit('error', {'message': '자기 자신과는 플레이할 수 없습니다.'})
-        return
-    session['players']['한'] = player_sid
+        return 'already_seated'
+    if vacated: leave_room(vacated[0])
+    release_seat(vacated)
     join_room(game_id)
-    print(f"Player {player_sid} joined game {game_id} as team '한'")
-    emit('game_started', {'message': '양쪽 플레이어가 모두 연결되었습니다. 게임을 시작합니다!'}, room=game_id)
-    emit('update_state', get_game_state_for_frontend(session['game']), room=game_id)
+    logger.info("player joined", extra={'fields': {'game_id': game_id, 'sid': player_sid, 'team': team}})
+    emit('game_joined', {'game_id': game_id, 'team': team})
+    if all(session['players'].values()):
+        emit('game_started', {'message': '양쪽 플레이어가 모두 연결되었습니다. 게임을 시작합니다!'}, room=game_id)
+    emit('update_state', state_snapshot(session), room=game_id)
+    # A restored AI game may have been saved with the AI to move.
+    game = session['game']
+    if session.get('vs_ai') and game.current_turn == AI_TEAM and not game.game_over:
+        socketio.start_background_task(play_ai_move, game_id)
+
+@socketio.on('request_resync')
+@instrumented('request_resync')
+def on_request_resync(data):
+    """A client that missed a state_delta gets a full snapshot; the room's sequence is unchanged."""
+    game_id = data.get('game_id')
+    session = sessions.get(game_id)
+    if not session or not sessions.team_of(request.sid, game_id):
+        emit('error', {'message': '해당 ID의 게임을 찾을 수 없습니다.'})
+        return
+    sessions.touch(game_id)
+    emit('update_state', state_snapshot(session, advance=False))
+
+@socketio.on('request_takeback')
+@instrumented('request_takeback')
+def on_request_takeback(data):
+    """Asks the opponent to take back the requester's last move; against the AI it is granted at once."""
+    game_id = data.get('game_id')
+    session = sessions.get(game_id)
+    team = sessions.team_of(request.sid, game_id)
+    if not session or not team:
+        emit('error', {'message': '게임의 플레이어가 아닙니다.'})
+        return
+    history = session['game'].move_history
+    if not any(len(history) >= n and history[-n].team == team for n in (1, 2)):
+        emit('error', {'message': '무를 수가 없습니다.'})
+        return
+    if session.get('vs_ai'):
+        takeback(game_id, session, team)
+        return
+    opponent_sid = session['players']['한' if team == '초' else '초']
+    if not opponent_sid:
+        emit('error', {'message': '상대방이 아직 참가하지 않았습니다.'})
+        return
+    session['takeback'] = team
+    emit('takeback_requested', {'team': team}, room=opponent_sid)
+
+@socketio.on('respond_takeback')
+@instrumented('respond_takeback')
+def on_respond_takeback(data):
+    game_id = data.get('game_id')
+    session = sessions.get(game_id)
+    team = sessions.team_of(request.sid, game_id)
+    requester = session['takeback'] if session and team else None
+    if not requester or requester == team:
+        emit('error', {'message': '처리할 무르기 요청이 없습니다.'})
+        return
+    if data.get('accept'):
+        if takeback(game_id, session, requester):
+            emit('takeback_accepted', {'team': requester}, room=game_id)
+        else:
+            session['takeback'] = None
+            emit('error', {'message': '무를 수가 없습니다.'})
+        return
+    session['takeback'] = None
+    requester_sid = session['players'].get(requester)
+    if requester_sid:
+        emit('takeback_declined', {'team': requester}, room=requester_sid)
+
+@socketio.on('replay_seek')
+@instrumented('replay_seek')
+def on_replay_seek(data):
+    """Shows the requester the position after `ply` moves in a private copy of the game.
+
+    The copy is stepped with undo/redo from wherever the last seek left it, and only the
+    squares that changed are sent ('replay_update_state' first, then 'replay_state_delta').
+    """
+    game_id = data.get('game_id')
+    session = sessions.get(game_id)
+    if not session or not sessions.team_of(request.sid, game_id):
+        replays.pop(request.sid, None)
+        emit('error', {'message': '해당 ID의 게임을 찾을 수 없습니다.'})
+        return
+    game = session['game']
+    replay = replays.get(request.sid)
+    if replay is None or replay[0] != game_id or replay[1] != game.version:
+        with session['lane'].lock:
+            view = game.copy()
+        view.move_history.clear_redo()
+        view.selected_pos, view.valid_moves = None, []
+        replay = replays[request.sid] = (game_id, game.version, view, StateTracker())
+    _, _, view, tracker = replay
+    try:
+        view.seek(int(data.get('ply')))
+    except (IndexError, TypeError, ValueError):
+        emit('error', {'message': '잘못된 수 번호입니다.'})
+        return
+    event, payload = tracker.update(view)
+    payload['ply'] = len(view.move_history)
+    payload['total_plies'] = len(view.move_history) + view.move_history.redo_count
+    emit('replay_' + event, payload)
+
+@socketio.on('replay_exit')
+def on_replay_exit(data=None):
+    replays.pop(request.sid, None)
 
 @socketio.on('handle_click')
+@instrumented('handle_click')
 def on_handle_click(data):
-    """Handles any click on the board from a player."""
+    """Handles any click on the board from a player. Returns the kind of click, for HANDLER_SECONDS."""
     player_sid = request.sid
     game_id = data.get('game_id')
     pos = tuple(data.get('pos'))
 
-    if game_id not in game_sessions:
-        print(f"[DEBUG] Invalid game_id: {game_id}")
-        return
-    session = game_sessions[game_id]
+    session = sessions.get(game_id)
+    if session is None:
+        logger.debug("click for unknown game", extra={'fields': {'game_id': game_id, 'sid': player_sid}})
+        return 'unknown_game'
     game = session['game']
 
-    player_team = get_player_team(player_sid, session)
+    player_team = sessions.team_of(player_sid, game_id)
 
     # --- Server-side Coordinate Transformation ---
     logical_pos = pos
@@ -136,49 +482,75 @@ def on_handle_click(data):
         logical_pos = (BOARD_HEIGHT - 1 - pos[0], BOARD_WIDTH - 1 - pos[1])
     # ---
 
-    # --- Start of Debugging Prints ---
-    clicked_piece = game.board_state[logical_pos[0]][logical_pos[1]]
-    print("="*20)
-    print(f"[DEBUG] Click received for game {game_id}")
-    print(f"  - Player SID: {player_sid}")
-    print(f"  - Player Team: {player_team}")
-    print(f"  - Current Turn: {game.current_turn}")
-    print(f"  - Visual Clicked Position (from client): {pos}")
-    print(f"  - Logical Position (after transform): {logical_pos}")
-    print(f"  - Clicked Piece: {clicked_piece.name if clicked_piece else 'None'} (Team: {clicked_piece.team if clicked_piece else 'N/A'})")
-    # --- End of Debugging Prints ---
+    if click_sampled(logger):
+        clicked_piece = game.board_state[logical_pos[0]][logical_pos[1]]
+        logger.debug("click", extra={'fields': {
+            'game_id': game_id, 'sid': player_sid, 'team': player_team, 'turn': game.current_turn,
+            'pos': pos, 'logical_pos': logical_pos,
+            'piece': clicked_piece.name if clicked_piece else None,
+            'piece_team': clicked_piece.team if clicked_piece else None,
+        }})
 
     if not all(session['players'].values()):
         emit('error', {'message': '상대방이 아직 참가하지 않았습니다.'})
-        return
+        return 'not_ready'
 
     if not player_team:
         emit('error', {'message': '게임의 플레이어가 아닙니다.'})
-        return
+        return 'not_player'
+
+    global _click_backlog
+    lane = session['lane']
+    if lane.pending >= GAME_QUEUE_DEPTH or _click_backlog >= CLICK_BACKLOG:
+        emit('error', {'message': '요청이 너무 많습니다. 잠시 후 다시 시도해 주세요.'})
+        return 'overloaded'
+    lane.pending += 1
+    _click_backlog += 1
+    try:
+        with lane.lock:
+            return process_click(game_id, session, player_team, logical_pos)
+    finally:
+        lane.pending -= 1
+        _click_backlog -= 1
 
+def process_click(game_id, session, player_team, logical_pos):
+    """The part of handle_click that reads and changes the game; runs holding the game's lane."""
+    game = session['game']
     if game.current_turn != player_team:
-        # Allow deselecting even if it's not your turn
+        # Allow deselecting even if it's not your turn. The click only clears the mover's
+        # selection; it never goes to handle_click, which would play it as a destination.
         if game.selected_pos:
-             game.handle_click(logical_pos) # Use logical_pos
-             emit('update_state', get_game_state_for_frontend(game), room=game_id)
-        else:
-             # emit('error', {'message': '자신의 턴이 아닙니다.'}) # Suppress error for clarity during debug
-             print(f"[DEBUG] Denied click: Not player's turn.")
-        return
+            game.selected_pos = None
+            game.valid_moves = []
+            sessions.touch(game_id)
+            broadcast_state(game_id, session)
+            return 'deselect'
+        # emit('error', {'message': '자신의 턴이 아닙니다.'}) # Suppress error for clarity during debug
+        logger.debug("click denied: not the player's turn", extra={'fields': {'game_id': game_id, 'sid': request.sid}})
+        return 'denied'
 
     if game.game_over:
         emit('error', {'message': '게임이 이미 종료되었습니다.'})
-        return
+        return 'game_over'
 
     # Process the click using the unified game logic
-    game.handle_click(logical_pos) # Use logical_pos
+    version = game.version
+    run_click(game, logical_pos) # Use logical_pos
+    moved = game.version != version
+    if moved:
+        record_move(game_id, session)
+    sessions.touch(game_id)
 
-    # Broadcast the new state to all players
-    emit('update_state', get_game_state_for_frontend(game), room=game_id)
+    # Broadcast what changed to all players
+    broadcast_state(game_id, session)
 
     if game.game_over:
-        emit('game_over', {'winner': game.winner}, room=game_id)
+        emit('game_over', {'winner': game.winner, 'reason': game.end_reason}, room=game_id)
+    elif session.get('vs_ai') and game.current_turn == AI_TEAM:
+        socketio.start_background_task(play_ai_move, game_id)
+    return 'move' if moved else 'select' if game.selected_pos else 'deselect'
 
 if __name__ == '__main__':
-    print("Starting KSH Game Backend Server...")
-    socketio.run(app, host='0.0.0.0', port=5000)
\ No newline at end of file
+    port = int(os.environ.get('KSH_PORT', 5000))
+    logger.info("starting KSH game backend server", extra={'fields': {'port': port, 'shard': SHARD[0], 'shards': SHARD[1]}})
+    socketio.run(app, host=os.environ.get('KSH_HOST', '0.0.0.0'), port=port)
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""FEN parsing benchmark: the table-driven GameState.parse_fen against the old char-by-char parser.
+
+Usage: python benchmarks/bench_fen.py [--positions N] [--seed S]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ksh_game import FEN, PIECE_CLASS_MAP, GameState
+
+
+def legacy_parse_fen(self, fen_string):
+    """GameState.parse_fen as it was before the table-driven rewrite, verbatim, as the baseline."""
+    board = [[None for _ in range(self.BOARD_WIDTH_CELLS)] for _ in range(self.BOARD_HEIGHT_CELLS)]
+    parts = fen_string.split('|')
+    piece_fen = parts[0]
+    moved_fen = parts[1] if len(parts) > 1 else None
+    group_fen = parts[2] if len(parts) > 2 else None
+    rows = piece_fen.split('/')
+    for y, row_str in enumerate(rows):
+        if y >= self.BOARD_HEIGHT_CELLS: continue
+        x = 0
+        i = 0
+        while i < len(row_str):
+            if x >= self.BOARD_WIDTH_CELLS: break
+            char = row_str[i]
+            if char.isdigit():
+                num_str = ""
+                j = i
+                while j < len(row_str) and row_str[j].isdigit():
+                    num_str += row_str[j]
+                    j += 1
+                x += int(num_str)
+                i = j
+            else:
+                team = '한' if char.isupper() else '초'
+                piece_class = PIECE_CLASS_MAP.get(char.lower())
+                if piece_class:
+                    piece = piece_class(team, (y, x))
+                    if not group_fen:
+                        if x < 4: piece.general_group = '좌'
+                        elif x > 10: piece.general_group = '우'
+                        else: piece.general_group = '중앙'
+                    board[y][x] = piece
+                x += 1
+                i += 1
+    if moved_fen:
+        moved_rows = moved_fen.split('/')
+        for y, row_str in enumerate(moved_rows):
+            if y >= self.BOARD_HEIGHT_CELLS: continue
+            x = 0
+            i = 0
+            while i < len(row_str):
+                if x >= self.BOARD_WIDTH_CELLS: break
+                char = row_str[i]
+                if char.isdigit():
+                    num_str = ""
+                    j = i
+                    while j < len(row_str) and row_str[j].isdigit():
+                        num_str += row_str[j]
+                        j += 1
+                    x += int(num_str)
+                    i = j
+                else:
+                    if board[y][x]: board[y][x].has_moved = True if char == 'm' else False
+                    x += 1
+                    i += 1
+    if group_fen:
+        group_rows = group_fen.split('/')
+        for y, row_str in enumerate(group_rows):
+            if y >= self.BOARD_HEIGHT_CELLS: continue
+            x = 0
+            i = 0
+            while i < len(row_str):
+                if x >= self.BOARD_WIDTH_CELLS: break
+                char = row_str[i]
+                if char.isdigit():
+                    num_str = ""
+                    j = i
+                    while j < len(row_str) and row_str[j].isdigit():
+                        num_str += row_str[j]
+                        j += 1
+                    x += int(num_str)
+                    i = j
+                else:
+                    if board[y][x]:
+                        if char == 'L': board[y][x].general_group = '좌'
+                        elif char == 'R': board[y][x].general_group = '우'
+                        elif char == 'C': board[y][x].general_group = '중앙'
+                    x += 1
+                    i += 1
+    return board
+
+
+def random_midgame_fens(count, seed, min_plies=20, max_plies=80):
+    """Plays random legal moves from the start position and records the resulting FENs."""
+    rnd = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        game = GameState()
+        for _ in range(rnd.randint(min_plies, max_plies)):
+            pieces = [(y, x) for y in range(game.BOARD_HEIGHT_CELLS) for x in range(game.BOARD_WIDTH_CELLS)
+                      if game.board_state[y][x] and game.board_state[y][x].team == game.current_turn]
+            rnd.shuffle(pieces)
+            for pos in pieces:
+                game.handle_click(pos)
+                if game.valid_moves:
+                    game.handle_click(rnd.choice(game.valid_moves))
+                    break
+                game.selected_pos, game.valid_moves = None, []
+            if game.game_over: break
+        fens.append(game.generate_fen())
+    return fens
+
+
+def random_game_history(seed, plies=120):
+    """The fen_before and fen_after of every move of one random game, as move_history stores them."""
+    rnd = random.Random(seed)
+    game = GameState()
+    fens = []
+    for _ in range(plies):
+        moves = game.legal_moves()
+        if not moves or game.game_over: break
+        before = game.generate_fen()
+        game.move_piece(*rnd.choice(moves))
+        fens += [before, game.generate_fen()]
+    return fens
+
+
+def bench(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"  {label:<28} {seconds * 1e6:10.1f} us")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--positions', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    game = GameState()
+    print(f"Generating {args.positions} random mid-game positions...")
+    fens = random_midgame_fens(args.positions, args.seed)
+
+    print("Starting FEN (per parse):")
+    old = bench("legacy parser", lambda: legacy_parse_fen(game, FEN), 2000)
+    new = bench("parse_fen", lambda: game.parse_fen(FEN), 2000)
+    print(f"  speedup {old / new:.1f}x")
+
+    print(f"Mid-game FENs (per batch of {len(fens)}):")
+    old = bench("legacy parser", lambda: [legacy_parse_fen(game, fen) for fen in fens], 5)
+    new = bench("parse_fen", lambda: [game.parse_fen(fen) for fen in fens], 5)
+    print(f"  speedup {old / new:.1f}x")
+
+    history = random_game_history(args.seed)
+    print(f"Bulk load of one game's history ({len(history)} FENs):")
+    old = bench("GameState(fen) each", lambda: [GameState(fen) for fen in history], 5)
+    new = bench("GameState.from_fens", lambda: GameState.from_fens(history), 5)
+    print(f"  speedup {old / new:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""Socket.IO load test: concurrent games against a server, reporting click latency, event
+throughput and server memory as the number of games grows.
+
+Each simulated game is two python-socketio clients. One creates the game and plays '초';
+the other joins it and plays '한', sending its clicks in flipped board coordinates as
+the frontend does. They take turns selecting a random piece of their own and playing a
+random one of its valid moves. Latency runs from emitting handle_click to the clicker
+receiving the update_state/state_delta that answers it.
+
+Usage: python benchmarks/loadtest.py [--games 1,10,50] [--plies P] [--think MS] [--seed S]
+                                     [--workers N | --url URL [--server-pid PID]]
+
+Without --url, app.py is started on a free local port for the run, or with --workers N
+the sharded deployment (ksh_router.py in front of N app.py workers), and the RSS of the
+server processes together is sampled after each step; with --url, pass --server-pid to
+get RSS. The clients run in this process, so on a machine with few cores they compete
+with the server for CPU.
+"""
+import argparse
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOARD_HEIGHT, BOARD_WIDTH = 14, 15
+TEAMS = ('초', '한')
+CLICK_KINDS = ('select', 'move', 'deselect')
+RESPONSE_TIMEOUT = 10
+
+
+class Player:
+    """One client: mirrors the room state from snapshots and deltas and times its own clicks."""
+
+    def __init__(self, url, team, latencies):
+        self.team = team
+        self.latencies = latencies
+        self.game_id = None
+        self.board = None
+        self.fields = {}
+        self.seq = None
+        self.events = 0
+        self.errors = 0
+        self.timeouts = 0
+        self._pending = None # (kind, sent at) of the click awaiting its update
+        self._changed = threading.Condition()
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('game_created', self._created)
+        self.client.on('update_state', self._full)
+        self.client.on('state_delta', self._delta)
+        self.client.on('error', self._error)
+        self.client.on('*', self._other)
+        self.client.connect(url, transports=['websocket'])
+
+    def _created(self, data):
+        with self._changed:
+            self.events += 1
+            self.game_id = data['game_id']
+            self._changed.notify_all()
+
+    def _full(self, data):
+        with self._changed:
+            self.events += 1
+            self.board = data.pop('board_state')
+            self.seq = data.pop('seq')
+            self.fields = data
+            self._answered()
+
+    def _delta(self, data):
+        with self._changed:
+            self.events += 1
+            if self.board is None or data['seq'] != self.seq + 1:
+                # Missed a message: the next update_state brings the whole state back.
+                self.client.emit('request_resync', {'game_id': self.game_id})
+                return
+            self.seq = data.pop('seq')
+            for y, x, cell in data.pop('squares'):
+                self.board[y][x] = cell
+            self.fields.update(data)
+            self._answered()
+
+    def _error(self, data):
+        with self._changed:
+            self.events += 1
+            self.errors += 1
+            self._pending = None
+            self._changed.notify_all()
+
+    def _other(self, event, data=None):
+        self.events += 1
+
+    def _answered(self):
+        if self._pending is not None:
+            kind, sent_at = self._pending
+            self.latencies[kind].append(time.perf_counter() - sent_at)
+            self._pending = None
+        self._changed.notify_all()
+
+    def wait_for(self, predicate, timeout=RESPONSE_TIMEOUT):
+        with self._changed:
+            return self._changed.wait_for(predicate, timeout)
+
+    def click(self, pos, kind):
+        """Clicks the logical square pos and waits for the answer. Returns False on an error or timeout."""
+        y, x = pos
+        if self.team == '한': # the 한 player sees the board upside down
+            y, x = BOARD_HEIGHT - 1 - y, BOARD_WIDTH - 1 - x
+        with self._changed:
+            errors = self.errors
+            self._pending = (kind, time.perf_counter())
+            self.client.emit('handle_click', {'game_id': self.game_id, 'pos': [y, x]})
+            if self._changed.wait_for(lambda: self._pending is None, RESPONSE_TIMEOUT):
+                return self.errors == errors
+            self._pending = None
+            self.timeouts += 1
+            return False
+
+    def play_random_move(self, rnd, think):
+        """Selects random pieces until one can move, then plays a random move. False if none can."""
+        own = [(y, x) for y, row in enumerate(self.board) for x, cell in enumerate(row) if cell and cell['team'] == self.team]
+        rnd.shuffle(own)
+        for pos in own:
+            if not self.click(pos, 'select'): return False
+            time.sleep(think)
+            moves = self.fields['valid_moves']
+            if moves:
+                return self.click(tuple(rnd.choice(moves)), 'move')
+            if self.fields['selected_pos'] and not self.click(pos, 'deselect'): return False
+            time.sleep(think)
+        return False
+
+    def close(self):
+        self.client.disconnect()
+
+
+def play_game(url, plies, think, rnd, latencies, players):
+    connected = []
+    try:
+        for team in TEAMS:
+            connected.append(Player(url, team, latencies))
+    except socketio.exceptions.ConnectionError:
+        for player in connected: player.close()
+        return
+    players.extend(connected)
+    chu, han = connected
+    try:
+        chu.client.emit('create_game')
+        if not chu.wait_for(lambda: chu.game_id and chu.board): return
+        han.game_id = chu.game_id
+        han.client.emit('join_game', {'game_id': chu.game_id})
+        if not han.wait_for(lambda: han.board): return
+        # The join snapshot also goes to the creator; it must not be taken for a click's answer.
+        if not chu.wait_for(lambda: chu.seq == han.seq): return
+        mover, opponent = chu, han
+        for _ in range(plies):
+            if not mover.play_random_move(rnd, think): break
+            # The opponent moves next, once its own view has caught up with the move.
+            if not opponent.wait_for(lambda: opponent.fields['current_turn'] == opponent.team or opponent.fields['game_over']): break
+            if opponent.fields['game_over']: break
+            mover, opponent = opponent, mover
+            time.sleep(think)
+    finally:
+        for player in connected: player.close()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values: return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+def rss_mb(pid):
+    """RSS of pid and all its descendants (the router's workers), or None if unreadable."""
+    total = None
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'): total = int(line.split()[1]) / 1024
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            for child in children.read().split():
+                child_rss = rss_mb(int(child))
+                if child_rss is not None: total = (total or 0) + child_rss
+    except OSError:
+        pass
+    return total
+
+
+def run_step(url, games, plies, think, seed):
+    latencies = {kind: [] for kind in CLICK_KINDS}
+    players = []
+    threads = [
+        threading.Thread(target=play_game, args=(url, plies, think, random.Random(seed + i), latencies, players))
+        for i in range(games)
+    ]
+    start = time.perf_counter()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    elapsed = time.perf_counter() - start
+    return latencies, players, elapsed
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers=0):
+    """Starts app.py on port, or with workers the router on port and its workers on the ports after it."""
+    env = dict(os.environ, KSH_PORT=str(port), KSH_HOST='127.0.0.1', KSH_LOG_LEVEL='WARNING')
+    script = 'app.py'
+    if workers:
+        env.update(KSH_WORKERS=str(workers), KSH_WORKER_BASE_PORT=str(port + 1))
+        env.pop('KSH_WORKER_URLS', None)
+        script = 'ksh_router.py'
+    # Its own process group, so stop_server() also reaches the router's workers.
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, script)], env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None: sys.exit(f"server exited with status {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    sys.exit("server did not start")
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=15)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', default='1,10,50', help="comma-separated numbers of concurrent games, one step each")
+    parser.add_argument('--plies', type=int, default=20, help="moves played per game")
+    parser.add_argument('--think', type=float, default=0.0, help="milliseconds each client waits between clicks")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="start ksh_router.py with this many workers instead of a single app.py")
+    parser.add_argument('--url', help="server to test (default: start app.py locally)")
+    parser.add_argument('--server-pid', type=int, help="pid of the --url server, for RSS")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url, pid = args.url, args.server_pid
+    else:
+        port = free_port()
+        server = start_server(port, args.workers)
+        url, pid = f"http://127.0.0.1:{port}", server.pid
+
+    try:
+        print(f"{'games':>6} {'clicks':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'events/s':>9} {'errors':>7} {'rss MB':>7}")
+        for games in (int(n) for n in args.games.split(',')):
+            latencies, players, elapsed = run_step(url, games, args.plies, args.think / 1000, args.seed)
+            combined = sorted(value for values in latencies.values() for value in values)
+            events = sum(player.events for player in players)
+            errors = sum(player.errors + player.timeouts for player in players)
+            rss = rss_mb(pid) if pid else None
+            print(f"{games:>6} {len(combined):>7} {percentile(combined, 50) * 1000:>8.2f} {percentile(combined, 95) * 1000:>8.2f} "
+                  f"{percentile(combined, 99) * 1000:>8.2f} {events / elapsed:>9.0f} {errors:>7} {rss if rss is None else round(rss, 1)!s:>7}")
+            for kind in CLICK_KINDS:
+                values = sorted(latencies[kind])
+                if values:
+                    print(f"{'':>6} {kind:>7} {percentile(values, 50) * 1000:>8.2f} {percentile(values, 95) * 1000:>8.2f} "
+                          f"{percentile(values, 99) * 1000:>8.2f}")
+    finally:
+        if server is not None:
+            stop_server(server)
+
+
+if __name__ == '__main__':
+    main()
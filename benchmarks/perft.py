@@ -0,0 +1,73 @@
+"""Perft suite: legal move generation correctness and speed.
+
+Counts the leaf nodes of GameState.perft on fixed positions, checks them against the stored
+node counts and reports nodes per second. Exits non-zero on any mismatch.
+
+Usage: python benchmarks/perft.py [--depth D] [--position NAME]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ksh_game import FEN, GameState
+
+# (name, fen, side to move, deactivated groups, node counts for depth 1, 2, 3, ...)
+POSITIONS = [
+    ("start", FEN, '초', (), (108, 11627, 1252108)),
+    ("midgame-11",
+     "3M3B3M3/RAE2RA1AER1EAR/1Q1L3K3L1Q1/N4N6C1N/3U6FU3/PPP5NPP1G1G/3G3G7/12p2/1g2pp2ggg2pp/3u3f3u3/n1c4n6n/1q2l1ak3l1q1/1aC1re2ner1ear/3m2c1b2m3"
+     "|3-3-3-3/---2m-1---1---/1-1-3-3-1-1/-4-6-1-/3-6m-3/---5m--1m1-/3m3m7/12m2/1-2--2---2--/3-3-3-3/-1-4m6-/1-2m1m-3-1-1/1-m1--2m--1---/3-2m1m2-3"
+     "|3L3C3R3/LLL2CC1CCC1RRR/1L1L3C3R1R1/L4C6R1R/3L6CR3/LLL5CCC1R1R/3C3C7/12R2/1L2CC2CCC2RR/3L3C3R3/L1L4C6R/1L2L1CC3R1R1/1LL1CC2CCC1RRR/3L2C1C2R3",
+     '초', (), (113, 11401, 1266447)),
+    ("midgame-12",
+     "3M3B3M3/RAQ1REA2E2EAR/7KA3L2/N2L1N3N2c1N/3U7U3/PPP1GG3P2GGG/7g3n3/13p1/g4p2C5p/2nue2f3u3/n4rc7n/rq5k3l1q1/1a1l1ea1ae2ear/3m3b3m3"
+     "|3-3-3-3/--m1---2-2---/7-m3m2/-2m1-3-2m1-/3-7-3/---1--3m2---/7m3m3/13m1/m4m2m5-/2m-m2-3-3/-4mm7-/m-5-3-1-1/1-1m1--1--2---/3-3-3-3"
+     "|3L3C3R3/LLL1CCC2C2RRR/7CC3R2/L2L1C3C2R1R/3L7R3/LLL1CC3C2RRR/7C3C3/13R1/L4C2R5R/2CLL2C3R3/L4CC7R/LL5C3R1R1/1L1L1CC1CC2RRR/3L3C3R3",
+     '한', ('한_우',), (60, 6710, 408280)),
+    ("midgame-13",
+     "3M5B5/RAE2E2AE2EN1/1QL3A1K4QR/N1C2N2C6/3U11/PP3G3P4G/2G12/15/gggp1pp5p1p/3u2r5n2/n4n2cn1l3/1q2r3ku3q1/ra5aae3a1/3m2b4m3"
+     "|3-5m5/---2-2--2-m1/1-m3m1m4-m/-1m2-2-6/3-11/--3-3m4-/2m12/15/---m1--5-1m/3-2m5m2/-4-2m-1m3/1-2m3mm3-1/--5m--3-1/3-2m4-3"
+     "|3L5C5/LLL2C2CC2RR1/1LL3C1C4RR/L1C2C2C6/3L11/LL3C3C4R/2C12/15/LLLC1CC5R1R/3L2C5R2/L4C2CC1R3/1L2C3CR3R1/LL5CCC3R1/3L2C4R3",
+     '초', (), (106, 7104, 735967)),
+]
+
+
+def load_position(fen, turn, deactivated):
+    game = GameState(fen)
+    game.current_turn = turn
+    for group_key in deactivated:
+        game.deactivated_groups[group_key] = True
+    game.zobrist_key = game.compute_zobrist_key()
+    return game
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--depth', type=int, default=2, help="maximum depth to run (stored counts go to 3)")
+    parser.add_argument('--position', help="run only the named position")
+    args = parser.parse_args()
+
+    failures = 0
+    total_nodes, total_seconds = 0, 0.0
+    for name, fen, turn, deactivated, counts in POSITIONS:
+        if args.position and name != args.position: continue
+        game = load_position(fen, turn, deactivated)
+        for depth, expected in enumerate(counts[:args.depth], start=1):
+            start = time.perf_counter()
+            nodes = game.perft(depth)
+            seconds = time.perf_counter() - start
+            total_nodes += nodes
+            total_seconds += seconds
+            status = "ok" if nodes == expected else f"MISMATCH (expected {expected})"
+            failures += nodes != expected
+            print(f"{name:<12} depth {depth}: {nodes:>9} nodes {seconds:8.2f}s {nodes / seconds:>10.0f} nps  {status}")
+    if total_seconds:
+        print(f"total: {total_nodes} nodes in {total_seconds:.2f}s, {total_nodes / total_seconds:.0f} nps")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
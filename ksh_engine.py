@@ -0,0 +1,461 @@
+import operator
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from ksh_game import (
+    BOARD_HEIGHT_CELLS, BOARD_WIDTH_CELLS, CODE_PIECE_CLASSES, GROUP_NAMES, HU_BLOCKED, HU_IMMOBILE,
+    JEON_RESTRICTED, RAYS, TEAM_CODE_OFFSET, GameState,
+)
+
+# --- Evaluation ---
+
+# Material in centipawn-like units. Su is never counted: losing it ends the game.
+# Jang is priced above Cha because capturing it deactivates its whole general group.
+PIECE_VALUES = {
+    'Su': 0, 'Jang': 1500, 'Cha': 1300, 'Po': 700, 'Ma': 500, 'Sang': 300, 'Sa': 300,
+    'Bo': 200, 'Gi': 200, 'Bok': 400, 'Yu': 400, 'Gi_L': 350, 'Jeon': 900, 'Hu': 800,
+}
+POSITION_WEIGHT = 4 # per move the piece would have from its square on an empty board
+MOBILITY_WEIGHT = 4 # per square a Cha, Hu or Jeon can actually move to along its lines
+MATE_SCORE = 1_000_000
+MATE_THRESHOLD = MATE_SCORE - 1000
+QUIESCENCE_DEPTH = 4
+TIME_CHECK_INTERVAL = 16 # nodes between clock reads; a node costs well under a millisecond
+
+# Material by square code, signed from 초's point of view.
+CODE_VALUES = [0] + [
+    PIECE_VALUES[piece_class.name] * (1 if code <= TEAM_CODE_OFFSET else -1)
+    for code, piece_class in enumerate(CODE_PIECE_CLASSES) if piece_class
+]
+
+_BOARD_SIZE = BOARD_WIDTH_CELLS * BOARD_HEIGHT_CELLS
+
+
+def _empty_board_reach(code):
+    """Per square, the moves the piece with this code has there when it is alone on the board."""
+    game = GameState('/'.join(['15'] * BOARD_HEIGHT_CELLS))
+    board_state = game.board_state
+    piece_class = CODE_PIECE_CLASSES[code]
+    team = '한' if code > TEAM_CODE_OFFSET else '초'
+    reach = []
+    for y in range(BOARD_HEIGHT_CELLS):
+        for x in range(BOARD_WIDTH_CELLS):
+            piece = board_state[y][x] = piece_class(team, (y, x))
+            if piece.name in ('Su', 'Jang'):
+                reach.append(len(piece._get_base_moves(board_state, game)))
+            else:
+                reach.append(len(piece.get_valid_moves(board_state, game)))
+            board_state[y][x] = None
+    return reach
+
+
+# Piece-square tables, signed from 초's point of view: material plus a positional bonus of
+# POSITION_WEIGHT per empty-board move, so a piece is worth more on squares with more reach.
+# These are static; they do not see the pieces in the way. Indexed SQUARE_BASES[idx] + code
+# (code 0, an empty square, is worth 0); POSITION_VALUES holds the positional part alone.
+_CODES = len(CODE_PIECE_CLASSES)
+SQUARE_BASES = [idx * _CODES for idx in range(_BOARD_SIZE)]
+POSITION_VALUES = [0] * (_BOARD_SIZE * _CODES)
+SQUARE_VALUES = [0] * (_BOARD_SIZE * _CODES)
+for _code, _piece_class in enumerate(CODE_PIECE_CLASSES):
+    if _piece_class is None: continue
+    _sign = 1 if _code <= TEAM_CODE_OFFSET else -1
+    for _idx, _moves in enumerate(_empty_board_reach(_code)):
+        POSITION_VALUES[SQUARE_BASES[_idx] + _code] = _sign * POSITION_WEIGHT * _moves
+        SQUARE_VALUES[SQUARE_BASES[_idx] + _code] = CODE_VALUES[_code] + POSITION_VALUES[SQUARE_BASES[_idx] + _code]
+
+# The long-range pieces whose real mobility evaluate counts, and their four lines per square
+# as flat indices (nearest square first).
+LINE_PIECE_CODES = tuple(code for code, piece_class in enumerate(CODE_PIECE_CLASSES)
+                         if piece_class and piece_class.name in ('Cha', 'Hu', 'Jeon'))
+LINE_RAYS = [
+    tuple(tuple(ry * BOARD_WIDTH_CELLS + rx for ry, rx in ray) for ray in RAYS[y][x])
+    for y in range(BOARD_HEIGHT_CELLS) for x in range(BOARD_WIDTH_CELLS)
+]
+_JEON_RESTRICTED = bytes(JEON_RESTRICTED[y][x] for y in range(BOARD_HEIGHT_CELLS) for x in range(BOARD_WIDTH_CELLS))
+_HU_IMMOBILE = {team: bytes(rows[y][x] for y in range(BOARD_HEIGHT_CELLS) for x in range(BOARD_WIDTH_CELLS))
+                for team, rows in HU_IMMOBILE.items()}
+_HU_BLOCKED = {team: bytes(rows[y][x] for y in range(BOARD_HEIGHT_CELLS) for x in range(BOARD_WIDTH_CELLS))
+               for team, rows in HU_BLOCKED.items()}
+
+SearchResult = namedtuple('SearchResult', ['best_move', 'score', 'depth', 'nodes', 'elapsed'])
+
+
+def _is_deactivated(game_state, idx, code):
+    group = game_state.group_flags[idx]
+    if not group or CODE_PIECE_CLASSES[code].name == 'Su': return False
+    team = '한' if code > TEAM_CODE_OFFSET else '초'
+    return game_state.deactivated_groups.get(f"{team}_{GROUP_NAMES[group]}", False)
+
+
+def line_mobility(game_state):
+    """Squares the Cha, Hu and Jeon can move to along their four lines, signed from 초's point of view.
+
+    Each line is walked on the compact squares array up to the first piece, which counts
+    if it can be captured, so blocked pieces score low. Palace diagonals are left out.
+    """
+    squares = game_state.squares
+    check_deactivated = any(game_state.deactivated_groups.values())
+    total = 0
+    for code in LINE_PIECE_CODES:
+        idx = squares.find(code)
+        while idx >= 0:
+            enemy = code <= TEAM_CODE_OFFSET # an enemy occupant has a code above the offset exactly when we do not
+            team = '초' if enemy else '한'
+            name = CODE_PIECE_CLASSES[code].name
+            if not (check_deactivated and _is_deactivated(game_state, idx, code)) \
+                    and not (name == 'Hu' and _HU_IMMOBILE[team][idx]):
+                moves = 0
+                for ray in LINE_RAYS[idx]:
+                    for target in ray:
+                        if name == 'Jeon' and _JEON_RESTRICTED[target]: break
+                        occupant = squares[target]
+                        if occupant and (occupant > TEAM_CODE_OFFSET) != enemy: break
+                        if not (name == 'Hu' and _HU_BLOCKED[team][target]): moves += 1
+                        if occupant: break
+                total += moves if team == '초' else -moves
+            idx = squares.find(code, idx + 1)
+    return total
+
+
+def evaluate(game_state):
+    """Scores the position from the side to move's point of view.
+
+    Material and a positional bonus come from SQUARE_VALUES, one table lookup per piece
+    on the compact squares array. On top of that comes the real mobility of the
+    long-range pieces (line_mobility), which is where blocking matters most; no moves are
+    generated. Pieces in a deactivated group keep their material but lose the rest since
+    they cannot move.
+    """
+    squares = game_state.squares
+    score = sum(map(SQUARE_VALUES.__getitem__, map(operator.add, SQUARE_BASES, squares)))
+    score += MOBILITY_WEIGHT * line_mobility(game_state)
+    if any(game_state.deactivated_groups.values()):
+        for idx, code in enumerate(squares):
+            if code and _is_deactivated(game_state, idx, code):
+                score -= POSITION_VALUES[SQUARE_BASES[idx] + code]
+    return score if game_state.current_turn == '초' else -score
+
+
+# --- Transposition Table ---
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 1, 2, 3
+DEFAULT_TABLE_BYTES = 32 * 1024 * 1024
+
+
+def encode_move(move):
+    """Packs ((fy, fx), (ty, tx)) into 1..BOARD_SIZE**2; 0 means no move."""
+    if move is None: return 0
+    (fy, fx), (ty, tx) = move
+    return (fy * BOARD_WIDTH_CELLS + fx) * _BOARD_SIZE + ty * BOARD_WIDTH_CELLS + tx + 1
+
+
+def decode_move(code):
+    if not code: return None
+    from_idx, to_idx = divmod(code - 1, _BOARD_SIZE)
+    return divmod(from_idx, BOARD_WIDTH_CELLS), divmod(to_idx, BOARD_WIDTH_CELLS)
+
+
+class TranspositionTable:
+    """Fixed-size table of search results keyed by GameState.zobrist_key.
+
+    Entries live in parallel typed arrays sized once from max_bytes, so memory never grows.
+    One slot per index; a store replaces the slot when it is empty, holds the same position,
+    was written by an older search (aging), or searched no deeper (depth-preferred).
+    Safe to share between searches running on different threads.
+    """
+    # key (8) + score (4) + move (2) + depth (1) + bound (1) + generation (1)
+    ENTRY_BYTES = 17
+
+    def __init__(self, max_bytes=DEFAULT_TABLE_BYTES):
+        self.size = max(1, max_bytes // self.ENTRY_BYTES)
+        self.keys = array('Q', bytes(8 * self.size))
+        self.scores = array('i', bytes(4 * self.size))
+        self.moves = array('H', bytes(2 * self.size))
+        self.depths = array('b', bytes(self.size))
+        self.bounds = array('B', bytes(self.size)) # 0 marks an empty slot
+        self.generations = array('B', bytes(self.size))
+        self.generation = 1
+        self.hits = self.misses = self.collisions = 0
+        self.stores = self.replacements = self.rejections = 0
+        self._lock = threading.Lock()
+
+    def new_search(self):
+        """Ages every stored entry by one search; they stay usable but become replaceable."""
+        with self._lock:
+            self.generation = self.generation % 255 + 1
+
+    def probe(self, key):
+        """Returns (depth, score, bound, move) for key, or None."""
+        idx = key % self.size
+        with self._lock:
+            if not self.bounds[idx]:
+                self.misses += 1
+                return None
+            if self.keys[idx] != key:
+                self.collisions += 1
+                return None
+            self.hits += 1
+            return self.depths[idx], self.scores[idx], self.bounds[idx], decode_move(self.moves[idx])
+
+    def store(self, key, depth, score, bound, move):
+        idx = key % self.size
+        with self._lock:
+            if self.bounds[idx]:
+                same_position = self.keys[idx] == key
+                if not same_position and self.generations[idx] == self.generation and depth < self.depths[idx]:
+                    self.rejections += 1
+                    return
+                if not same_position: self.replacements += 1
+                elif not move: move = decode_move(self.moves[idx]) # keep the best move we already had
+            self.keys[idx] = key
+            self.scores[idx] = score
+            self.moves[idx] = encode_move(move)
+            self.depths[idx] = min(depth, 127)
+            self.bounds[idx] = bound
+            self.generations[idx] = self.generation
+            self.stores += 1
+
+    def clear(self):
+        with self._lock:
+            self.bounds = array('B', bytes(self.size))
+
+    def stats(self):
+        with self._lock:
+            probes = self.hits + self.misses + self.collisions
+            return {
+                'size': self.size, 'bytes': self.size * self.ENTRY_BYTES,
+                'hits': self.hits, 'misses': self.misses, 'collisions': self.collisions,
+                'hit_rate': self.hits / probes if probes else 0.0,
+                'stores': self.stores, 'replacements': self.replacements, 'rejections': self.rejections,
+            }
+
+
+_shared_table = None
+_shared_table_lock = threading.Lock()
+
+
+def configure_shared_table(max_bytes):
+    """Replaces the table every search shares by default with one capped at max_bytes."""
+    global _shared_table
+    with _shared_table_lock:
+        _shared_table = TranspositionTable(max_bytes)
+    return _shared_table
+
+
+def get_shared_table():
+    global _shared_table
+    with _shared_table_lock:
+        if _shared_table is None:
+            _shared_table = TranspositionTable()
+        return _shared_table
+
+
+def _score_to_table(score, ply):
+    """Mate scores are stored relative to the node, not the root."""
+    if score >= MATE_THRESHOLD: return score + ply
+    if score <= -MATE_THRESHOLD: return score - ply
+    return score
+
+
+def _score_from_table(score, ply):
+    if score >= MATE_THRESHOLD: return score - ply
+    if score <= -MATE_THRESHOLD: return score + ply
+    return score
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Searcher:
+    """Iterative-deepening alpha-beta (negamax) over a private copy of a GameState.
+
+    Moves are generated pseudo-legally and only checked for legality when they are
+    actually searched, so cutoffs also save the legality checks of the moves they skip.
+    """
+
+    def __init__(self, game_state, time_budget=1.0, max_depth=6, table=None):
+        self.game = game_state.copy()
+        self.game.selected_pos = None
+        self.game.valid_moves = []
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.nodes = 0
+        self.deadline = None
+        self.eval_cache = {} # zobrist_key -> evaluate()
+        self.killers = {} # ply -> up to two quiet moves that caused a cutoff
+        self.table = table if table is not None else get_shared_table()
+
+    def search(self):
+        start = time.perf_counter()
+        self.deadline = start + self.time_budget
+        root_moves = self.game.legal_moves()
+        if not root_moves:
+            return SearchResult(None, -MATE_SCORE, 0, 0, 0.0)
+        self.table.new_search()
+        entry = self.table.probe(self.game.zobrist_key)
+        best_move = entry[3] if entry and entry[3] in root_moves else root_moves[0]
+        best_score, completed_depth = 0, 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                score, move = self._search_root(root_moves, depth, best_move)
+            except SearchTimeout:
+                break
+            best_move, best_score, completed_depth = move, score, depth
+            self.table.store(self.game.zobrist_key, depth, score, EXACT, move)
+            if abs(score) >= MATE_THRESHOLD: break
+        return SearchResult(best_move, best_score, completed_depth, self.nodes, time.perf_counter() - start)
+
+    def _search_root(self, root_moves, depth, pv_move):
+        alpha, beta = -MATE_SCORE - 1, MATE_SCORE + 1
+        best_move = None
+        for move in self._ordered(root_moves, 0, pv_move):
+            score = -self._child_score(move, depth - 1, -beta, -alpha, 1)
+            if best_move is None or score > alpha:
+                alpha, best_move = score, move
+        return alpha, best_move
+
+    def _child_score(self, move, depth, alpha, beta, ply):
+        """Scores a root move known to be legal."""
+        captured_piece = self.game.board_state[move[1][0]][move[1][1]]
+        if captured_piece and captured_piece.name == 'Su':
+            return -(MATE_SCORE - ply)
+        undo = self._make(move)
+        try:
+            return self._alpha_beta(depth, alpha, beta, ply)
+        finally:
+            self._unmake(undo)
+
+    def _alpha_beta(self, depth, alpha, beta, ply):
+        self._count_node()
+        if depth <= 0:
+            return self._quiescence(alpha, beta, ply, QUIESCENCE_DEPTH)
+        key = self.game.zobrist_key
+        table_move = None
+        entry = self.table.probe(key)
+        if entry:
+            entry_depth, entry_score, bound, table_move = entry
+            if entry_depth >= depth:
+                entry_score = _score_from_table(entry_score, ply)
+                if bound == EXACT: return entry_score
+                if bound == LOWER_BOUND and entry_score >= beta: return entry_score
+                if bound == UPPER_BOUND and entry_score <= alpha: return entry_score
+        alpha_before = alpha
+        best_score, best_move = None, None
+        for move in self._ordered(self._pseudo_moves(), ply, table_move):
+            captured_piece = self.game.board_state[move[1][0]][move[1][1]]
+            undo = self._make(move)
+            if undo is None: continue
+            if captured_piece and captured_piece.name == 'Su':
+                self._unmake(undo)
+                score = MATE_SCORE - ply
+            else:
+                try:
+                    score = -self._alpha_beta(depth - 1, -beta, -alpha, ply + 1)
+                finally:
+                    self._unmake(undo)
+            if best_score is None or score > best_score:
+                best_score, best_move = score, move
+            if score >= beta:
+                if captured_piece is None: self._add_killer(ply, move)
+                break
+            if score > alpha: alpha = score
+        if best_score is None:
+            return -(MATE_SCORE - ply) # no legal move loses, in check or not
+        if best_score >= beta: bound = LOWER_BOUND
+        elif best_score <= alpha_before: bound = UPPER_BOUND
+        else: bound = EXACT
+        self.table.store(key, depth, _score_to_table(best_score, ply), bound, best_move)
+        return best_score
+
+    def _evaluate(self):
+        key = self.game.zobrist_key
+        score = self.eval_cache.get(key)
+        if score is None:
+            score = self.eval_cache[key] = evaluate(self.game)
+        return score
+
+    def _quiescence(self, alpha, beta, ply, depth):
+        stand_pat = self._evaluate()
+        if stand_pat >= beta or depth <= 0: return stand_pat
+        alpha = max(alpha, stand_pat)
+        board_state = self.game.board_state
+        for move in self._ordered(self.game.capture_moves(), ply):
+            captured_piece = board_state[move[1][0]][move[1][1]]
+            undo = self._make(move)
+            if undo is None: continue
+            if captured_piece.name == 'Su':
+                self._unmake(undo)
+                return MATE_SCORE - ply
+            self._count_node()
+            try:
+                score = -self._quiescence(-beta, -alpha, ply + 1, depth - 1)
+            finally:
+                self._unmake(undo)
+            if score >= beta: return score
+            if score > alpha: alpha = score
+        return alpha
+
+    def _pseudo_moves(self):
+        """Moves of every movable piece of the side to move, before the own-Su check filter."""
+        game = self.game
+        board_state = game.board_state
+        moves = []
+        for row in board_state:
+            for piece in row:
+                if piece is None or piece.team != game.current_turn or game.is_piece_deactivated(piece): continue
+                from_pos = piece.position
+                moves.extend((from_pos, to_pos) for to_pos in piece.get_valid_moves(board_state, game))
+        return moves
+
+    def _make(self, move):
+        """Plays move and passes the turn; returns None (board unchanged) if it leaves the mover in check."""
+        game = self.game
+        undo = game.make_move(*move)
+        in_check, _ = game.is_su_in_check(game.current_turn, game.board_state)
+        if in_check:
+            game.unmake_move(undo)
+            return None
+        game.switch_turn()
+        return undo
+
+    def _unmake(self, undo):
+        self.game.switch_turn()
+        self.game.unmake_move(undo)
+
+    def _add_killer(self, ply, move):
+        killers = self.killers.setdefault(ply, [])
+        if move in killers: return
+        killers.insert(0, move)
+        del killers[2:]
+
+    def _ordered(self, moves, ply, first_move=None):
+        """PV move, captures by most valuable victim / least valuable attacker, killers, the rest."""
+        board_state = self.game.board_state
+        killers = self.killers.get(ply, ())
+        def order_key(move):
+            if move == first_move: return -10**9
+            (fy, fx), (ty, tx) = move
+            victim = board_state[ty][tx]
+            if victim is None:
+                return -1 if move in killers else 0
+            return -(PIECE_VALUES[victim.name] * 16 - PIECE_VALUES[board_state[fy][fx].name] // 100) - 2
+        return sorted(moves, key=order_key)
+
+    def _count_node(self):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_INTERVAL == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+
+def find_best_move(game_state, time_budget=1.0, max_depth=6, table=None):
+    """Searches the position for the side to move within time_budget seconds.
+
+    The live game is never touched; the search runs on a copy, so it is safe to call
+    from a worker thread while the game keeps being served. Results are cached in the
+    shared transposition table unless another table is given.
+    """
+    return Searcher(game_state, time_budget, max_depth, table).search()
@@ -1,22 +1,42 @@
 import math
+import random
+from array import array
+from collections import namedtuple
+
+from ksh_zones import (
+    BOARD_HEIGHT_CELLS, BOARD_WIDTH_CELLS, INNER, INNER_AREA, MAIN_PALACE, OUTER, OUTER_AREA_BOUNDS, OUTER_OUTER,
+    PALACE, PALACE_DIAGONAL_PATHS, PALACES, SIDE_PALACE_KEYS, TEAMS, in_zone, is_palace_diagonal_step, palace_at,
+)
 
 # --- Constants ---
-BOARD_WIDTH_CELLS = 15
-BOARD_HEIGHT_CELLS = 14
 FEN = "3M3B3M3/RAE1REA1AER1EAR/1Q1L3K3L1Q1/N1C2NC1CN2C1N/3U3F3U3/PPP1GGG1PPP1GGG/15/15/ggg1ppp1ggg1ppp/3u3f3u/n1c2nc1cn2c1n/1q1l3k3l1q1/rae1rea1aer1ear/3m3b3m3"
 
+# Shared (y, x) tuples so pieces on the same square don't each allocate their own.
+SQUARE_POSITIONS = [[(y, x) for x in range(BOARD_WIDTH_CELLS)] for y in range(BOARD_HEIGHT_CELLS)]
+
 # --- Piece Classes (from pieces.py) ---
 
 class Piece:
     """모든 기물의 부모 클래스"""
+    __slots__ = ('team', 'position', 'has_moved', 'general_group', 'captured_general_group', 'code')
+    name = 'Piece'
+    base_code = 0
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.name = cls.__name__
+
     def __init__(self, team, position):
         self.team = team
         self.position = position # (y, x) 튜플
-        self.name = self.__class__.__name__
         self.has_moved = False # 기물이 한 번이라도 움직였는지 여부
-        self.forward_dir = -1 if team == '초' else 1
         self.general_group = '중앙'
         self.captured_general_group = None
+        self.code = self.base_code + (TEAM_CODE_OFFSET if team == '한' else 0) # squares 배열에 저장되는 기물 코드
+
+    @property
+    def forward_dir(self):
+        return -1 if self.team == '초' else 1
 
     def get_valid_moves(self, board_state, game_state):
         raise NotImplementedError
@@ -31,6 +51,7 @@ class Piece:
         return True
 
 class Su(Piece):
+    __slots__ = ()
     korean_name = '수'
     def _get_base_moves(self, board_state, game_state):
         moves = []
@@ -58,6 +79,7 @@ class Su(Piece):
         return safe_moves
 
 class Jang(Piece):
+    __slots__ = ()
     korean_name = '장'
     def get_valid_moves(self, board_state, game_state):
         return Su.get_valid_moves(self, board_state, game_state)
@@ -65,6 +87,7 @@ class Jang(Piece):
         return Su._get_base_moves(self, board_state, game_state)
 
 class Cha(Piece):
+    __slots__ = ()
     korean_name = '차'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -83,9 +106,8 @@ class Cha(Piece):
                 ny += dy
                 nx += dx
         
-        palace_keys_to_check = ['초', '초_좌', '초_우','한', '한_좌', '한_우']
-        for key in palace_keys_to_check:
-            if not game_state.is_in_palace(self.position, self.team, check_palace_key=key): continue
+        key = palace_at(y, x)
+        if key is not None:
             y1, x1, y2, x2 = game_state.palaces[key]
             cy, cx = (y1 + y2) // 2, (x1 + x2) // 2
             diagonal_paths = [[(y1, x1), (cy, cx), (y2, x2)], [(y1, x2), (cy, cx), (y2, x1)]]
@@ -109,6 +131,7 @@ class Cha(Piece):
         return moves
 
 class Po(Piece):
+    __slots__ = ()
     korean_name = '포'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -133,9 +156,8 @@ class Po(Piece):
                 ny += dy
                 nx += dx
         
-        palace_keys_to_check = ['초', '초_좌', '초_우'] if self.team == '초' else ['한', '한_좌', '한_우']
-        for key in palace_keys_to_check:
-            if not game_state.is_in_palace(self.position, self.team, check_palace_key=key): continue
+        key = palace_at(y, x)
+        if key is not None and in_zone(y, x, self.team, PALACE):
             y1, x1, y2, x2 = game_state.palaces[key]
             cy, cx = (y1 + y2) // 2, (x1 + x2) // 2
             is_corner = (self.position in [(y1, x1), (y1, x2), (y2, x1), (y2, x2)])
@@ -154,6 +176,7 @@ class Po(Piece):
         return moves
 
 class Ma(Piece):
+    __slots__ = ()
     korean_name = '마'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -173,6 +196,7 @@ class Ma(Piece):
         return moves
 
 class Sang(Piece):
+    __slots__ = ()
     korean_name = '상'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -195,6 +219,7 @@ class Sang(Piece):
         return moves
 
 class Sa(Piece):
+    __slots__ = ()
     korean_name = '사'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -212,6 +237,7 @@ class Sa(Piece):
         return moves
 
 class Bo(Piece):
+    __slots__ = ()
     korean_name = '보'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -230,6 +256,7 @@ class Bo(Piece):
         return moves
 
 class Gi(Piece):
+    __slots__ = ()
     korean_name = '기'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -242,6 +269,7 @@ class Gi(Piece):
         return moves
 
 class Bok(Piece):
+    __slots__ = ()
     korean_name = '복'
     def _get_attack_range(self, board_state):
         y, x = self.position
@@ -270,6 +298,7 @@ class Bok(Piece):
         return moves
 
 class Yu(Piece):
+    __slots__ = ()
     korean_name = '유'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -286,6 +315,7 @@ class Yu(Piece):
         return moves
 
 class Gi_L(Piece):
+    __slots__ = ()
     korean_name = '기L'
     def get_valid_moves(self, board_state, game_state):
         moves = []
@@ -304,11 +334,10 @@ class Gi_L(Piece):
         return moves
 
 class Jeon(Piece):
+    __slots__ = ()
     korean_name = '전'
     def _is_restricted_area(self, pos, game_state):
-        if game_state.is_in_inner_area(pos, '초') or game_state.is_in_inner_area(pos, '한'): return True
-        if game_state.is_in_palace(pos, '초', check_main_palace_only=True) or game_state.is_in_palace(pos, '한', check_main_palace_only=True): return True
-        return False
+        return JEON_RESTRICTED[pos[0]][pos[1]]
     def get_valid_moves(self, board_state, game_state):
         moves = []
         y, x = self.position
@@ -328,9 +357,8 @@ class Jeon(Piece):
                     break
                 ny += dy
                 nx += dx
-        palace_keys_to_check = ['초_좌', '초_우', '한_좌', '한_우']
-        for key in palace_keys_to_check:
-            if not game_state.is_in_palace(self.position, self.team, check_palace_key=key): continue
+        key = palace_at(y, x)
+        if key in SIDE_PALACE_KEYS:
             y1, x1, y2, x2 = game_state.palaces[key]
             cy, cx = (y1 + y2) // 2, (x1 + x2) // 2
             diagonal_paths = [[(y1, x1), (cy, cx), (y2, x2)], [(y1, x2), (cy, cx), (y2, x1)]]
@@ -350,187 +378,767 @@ class Jeon(Piece):
         return moves
 
 class Hu(Piece):
+    __slots__ = ()
     korean_name = '후'
     def get_valid_moves(self, board_state, game_state):
-        # 1. Get all potential moves as if it were a Cha.
-        potential_moves = Cha.get_valid_moves(self, board_state, game_state)
-        
-        moves = []
-        opponent_team = '한' if self.team == '초' else '초'
-
         # Hu cannot move if it starts in the "outer-outer" area.
-        if game_state.is_in_outer_outer_area(self.position, self.team):
+        if HU_IMMOBILE[self.team][self.position[0]][self.position[1]]:
             return []
 
-        # 2. Filter the potential moves based on Hu's specific restrictions.
-        for move in potential_moves:
-            # Restricted areas Hu cannot enter:
-            # 1. Its own "outer-outer" area.
-            is_outside_allowed_zone = game_state.is_in_outer_outer_area(move, self.team)
-            # 2. The opponent's main palace.
-            is_opponent_main_palace = game_state.is_in_palace(move, opponent_team, check_main_palace_only=True)
-            # 3. The opponent's inner area.
-            is_opponent_inner_area = game_state.is_in_inner_area(move, opponent_team)
-
-            # If the move is not into any of the restricted zones, it's valid.
-            if not (is_outside_allowed_zone or is_opponent_main_palace or is_opponent_inner_area):
-                moves.append(move)
-                
+        # Otherwise it moves like a Cha, but never into its own "outer-outer" area, the
+        # opponent's main palace or the opponent's inner area (see HU_BLOCKED).
+        blocked = HU_BLOCKED[self.team]
+        moves = [move for move in Cha.get_valid_moves(self, board_state, game_state) if not blocked[move[0]][move[1]]]
         return list(set(moves)) # Use set to remove any duplicate moves
 
 PIECE_CLASS_MAP = {'K': Su, 'Q': Jang, 'R': Cha, 'C': Po, 'N': Ma, 'E': Sang, 'A': Sa, 'P': Bo, 'G': Gi, 'M': Bok, 'U': Yu, 'L': Gi_L, 'F': Jeon, 'B': Hu, 'k': Su, 'q': Jang, 'r': Cha, 'c': Po, 'n': Ma, 'e': Sang, 'a': Sa, 'p': Bo, 'g': Gi, 'm': Bok, 'u': Yu, 'l': Gi_L, 'f': Jeon, 'b': Hu}
 PIECE_FEN_MAP = {'Su': 'k', 'Jang': 'q', 'Cha': 'r', 'Po': 'c', 'Ma': 'n', 'Sang': 'e', 'Sa': 'a', 'Bo': 'p', 'Gi': 'g', 'Bok': 'm', 'Yu': 'u', 'Gi_L': 'l', 'Jeon': 'f', 'Hu': 'b'}
 
+# --- Compact Board Encoding ---
+# GameState mirrors the board in flat 210-entry bytearrays indexed by y * BOARD_WIDTH_CELLS + x.
+# squares holds piece codes: 0 is empty, 1..14 are 초 pieces in PIECE_FEN_CHARS order, 15..28 are 한.
+PIECE_FEN_CHARS = 'kqrcneapgmulfb'
+TEAM_CODE_OFFSET = len(PIECE_FEN_CHARS)
+CODE_FEN_CHARS = '.' + PIECE_FEN_CHARS + PIECE_FEN_CHARS.upper()
+CODE_PIECE_CLASSES = [None] + [PIECE_CLASS_MAP[char] for char in PIECE_FEN_CHARS] * 2
+GROUP_CODES = {'중앙': 0, '좌': 1, '우': 2}
+GROUP_NAMES = ('중앙', '좌', '우')
+GROUP_FEN_CHARS = 'CLR'
+# captured_general_group values; index + 1 is stored, 0 means none.
+CAPTURED_GROUP_KEYS = ('초_좌', '초_우', '초_중앙', '한_좌', '한_우', '한_중앙')
+CAPTURED_GROUP_CODES = {key: i + 1 for i, key in enumerate(CAPTURED_GROUP_KEYS)}
+# Keys every deactivated_groups dict starts with; a '_중앙' key only appears once such a Jang is captured.
+DEACTIVATED_GROUP_KEYS = ('초_좌', '초_우', '한_좌', '한_우')
+for _piece_class in set(PIECE_CLASS_MAP.values()):
+    _piece_class.base_code = PIECE_FEN_CHARS.index(PIECE_FEN_MAP[_piece_class.name]) + 1
+SU_CODES = {'초': PIECE_FEN_CHARS.index('k') + 1, '한': PIECE_FEN_CHARS.index('k') + 1 + TEAM_CODE_OFFSET}
+
+# --- FEN Parsing Tables ---
+FEN_CHAR_PIECES = {}
+for _char, _piece_class in PIECE_CLASS_MAP.items():
+    FEN_CHAR_PIECES[_char] = (_piece_class, '한' if _char.isupper() else '초')
+FEN_GROUP_NAMES = {'L': '좌', 'R': '우', 'C': '중앙'}
+# general_group by file when the FEN carries no group part
+DEFAULT_GROUPS = tuple('좌' if x < 4 else '우' if x > 10 else '중앙' for x in range(BOARD_WIDTH_CELLS))
+FEN_DIGITS = {str(digit): digit for digit in range(10)}
+
+def expand_fen_row(row_str):
+    """Returns (x, char) for every non-empty entry of a FEN row that lands on the board."""
+    cells = []
+    x = run = 0
+    for char in row_str:
+        digit = FEN_DIGITS.get(char)
+        if digit is not None:
+            run = run * 10 + digit
+            continue
+        x += run
+        run = 0
+        if x >= BOARD_WIDTH_CELLS: break
+        cells.append((x, char))
+        x += 1
+    return cells
+
+FEN_CHAR_CODES = {char: CODE_FEN_CHARS.index(char) for char in PIECE_CLASS_MAP}
+GROUP_FEN_CODES = {char: GROUP_CODES[name] for char, name in FEN_GROUP_NAMES.items()}
+_NO_FEN_ROW = ''
+
+def decode_fen_row(piece_row, moved_row, group_row):
+    """Returns the squares, moved_flags and group_flags bytes of one board row.
+
+    group_row is None when the FEN has no group part, which gives every piece its default
+    group by file, as parse_fen does.
+    """
+    squares = bytearray(BOARD_WIDTH_CELLS)
+    moved_flags = bytearray(BOARD_WIDTH_CELLS)
+    group_flags = bytearray(BOARD_WIDTH_CELLS)
+    for x, char in expand_fen_row(piece_row):
+        code = FEN_CHAR_CODES.get(char)
+        if code is None: continue
+        squares[x] = code
+        if group_row is None: group_flags[x] = GROUP_CODES[DEFAULT_GROUPS[x]]
+    for x, char in expand_fen_row(moved_row):
+        if squares[x]: moved_flags[x] = char == 'm'
+    if group_row is not None:
+        for x, char in expand_fen_row(group_row):
+            if squares[x] and char in GROUP_FEN_CODES: group_flags[x] = GROUP_FEN_CODES[char]
+    return bytes(squares), bytes(moved_flags), bytes(group_flags)
+
+# --- Zobrist Hashing ---
+# 64-bit keys per (array value, square). Row 0 of every table is zero so that empty
+# squares and default flags contribute nothing. Seeded so keys are stable across runs.
+_zobrist_random = random.Random(0x4B5348)
+_BOARD_SIZE = BOARD_WIDTH_CELLS * BOARD_HEIGHT_CELLS
+
+def _zobrist_table(rows):
+    return [[0] * _BOARD_SIZE] + [[_zobrist_random.getrandbits(64) for _ in range(_BOARD_SIZE)] for _ in range(rows - 1)]
+
+ZOBRIST_PIECES = _zobrist_table(len(CODE_FEN_CHARS))
+ZOBRIST_MOVED = _zobrist_table(2)
+ZOBRIST_GROUPS = _zobrist_table(len(GROUP_NAMES))
+ZOBRIST_CAPTURED_GROUPS = _zobrist_table(len(CAPTURED_GROUP_KEYS) + 1)
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64) # 한 to move
+ZOBRIST_DEACTIVATED = {key: _zobrist_random.getrandbits(64) for key in CAPTURED_GROUP_KEYS}
+
+def zobrist_deactivated_key(deactivated_groups):
+    key = 0
+    for group_key, deactivated in deactivated_groups.items():
+        if deactivated: key ^= ZOBRIST_DEACTIVATED.get(group_key, 0)
+    return key
+
+# --- Attack Tables ---
+# Precomputed per target square: "from which squares could a piece of a given type
+# reach this square". is_square_under_attack looks outward from the target with these
+# instead of generating every enemy move. All tables are indexed [y][x].
+
+def _on_board(y, x):
+    return 0 <= y < BOARD_HEIGHT_CELLS and 0 <= x < BOARD_WIDTH_CELLS
+
+def _grid(factory):
+    return [[factory(y, x) for x in range(BOARD_WIDTH_CELLS)] for y in range(BOARD_HEIGHT_CELLS)]
+
+def _step_attackers(team):
+    """Squares a Su/Jang/Sa of `team` can step from to reach each target."""
+    def build(y, x):
+        if not in_zone(y, x, team, PALACE): return ()
+        sources = []
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                if dy == 0 and dx == 0: continue
+                sy, sx = y - dy, x - dx
+                if not _on_board(sy, sx): continue
+                if dy != 0 and dx != 0 and not is_palace_diagonal_step(sy, sx, y, x): continue
+                sources.append((sy, sx))
+        return tuple(sources)
+    return _grid(build)
+
+def _leg_attackers(steps):
+    """Reverses (dy, dx, *legs) jump patterns into (source, *legs) tuples per target."""
+    def build(y, x):
+        sources = []
+        for dy, dx, *legs in steps:
+            sy, sx = y - dy, x - dx
+            if not _on_board(sy, sx): continue
+            entry = [sy, sx]
+            for ly, lx in zip(legs[::2], legs[1::2]):
+                entry.extend((sy + ly, sx + lx))
+            sources.append(tuple(entry))
+        return tuple(sources)
+    return _grid(build)
+
+_MA_STEPS = [(-2, -1, -1, 0), (-2, 1, -1, 0), (2, -1, 1, 0), (2, 1, 1, 0),
+             (-1, -2, 0, -1), (-1, 2, 0, 1), (1, -2, 0, -1), (1, 2, 0, 1)]
+_SANG_STEPS = [(-3, -2, -1, 0, -2, -1), (-3, 2, -1, 0, -2, 1), (3, -2, 1, 0, 2, -1), (3, 2, 1, 0, 2, 1),
+               (-2, -3, 0, -1, -1, -2), (-2, 3, 0, 1, -1, 2), (2, -3, 0, -1, 1, -2), (2, 3, 0, 1, 1, 2)]
+_YU_STEPS = [(-2, -2, -1, -1), (-2, 2, -1, 1), (2, -2, 1, -1), (2, 2, 1, 1)]
+
+def _bok_attackers(y, x):
+    """(bok, lane1, lane2) for every Bok whose attack range covers the target."""
+    sources = []
+    for dy, dx in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+        sides = [(dy, -1), (dy, 1)] if dy != 0 else [(-1, dx), (1, dx)]
+        for oy, ox in sides:
+            # target = bok + 2*(dy, dx) + (oy, ox)
+            by, bx = y - oy - 2 * dy, x - ox - 2 * dx
+            p1, p2 = (by + dy, bx + dx), (by + 2 * dy, bx + 2 * dx)
+            if _on_board(by, bx) and _on_board(*p1) and _on_board(*p2):
+                sources.append((by, bx) + p1 + p2)
+    return tuple(sources)
+
+def _rays(y, x):
+    rays = []
+    for dy, dx in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+        ray = []
+        ny, nx = y + dy, x + dx
+        while _on_board(ny, nx):
+            ray.append((ny, nx))
+            ny += dy
+            nx += dx
+        rays.append(tuple(ray))
+    return tuple(rays)
+
+def _palace_lines(y, x):
+    """(palace_key, squares) for every palace diagonal running outward from the target."""
+    lines = []
+    for key, (y1, x1, y2, x2) in PALACES.items():
+        cy, cx = (y1 + y2) // 2, (x1 + x2) // 2
+        for path in ([(y1, x1), (cy, cx), (y2, x2)], [(y1, x2), (cy, cx), (y2, x1)]):
+            if (y, x) not in path: continue
+            idx = path.index((y, x))
+            for line in (path[idx + 1:], path[:idx][::-1]):
+                if line: lines.append((key, tuple(line)))
+    return tuple(lines)
+
+def _po_corner_attackers(team):
+    """(center, opposite corner) pairs for Po corner jumps inside `team`'s palaces."""
+    def build(y, x):
+        sources = []
+        for key in (team, f"{team}_좌", f"{team}_우"):
+            y1, x1, y2, x2 = PALACES[key]
+            corners = {(y1, x1): (y2, x2), (y1, x2): (y2, x1), (y2, x1): (y1, x2), (y2, x2): (y1, x1)}
+            if (y, x) in corners:
+                sources.append(((y1 + y2) // 2, (x1 + x2) // 2) + corners[(y, x)])
+        return tuple(sources)
+    return _grid(build)
+
+STEP_ATTACKERS = {team: _step_attackers(team) for team in TEAMS}
+MA_ATTACKERS = _leg_attackers(_MA_STEPS)
+SANG_ATTACKERS = _leg_attackers(_SANG_STEPS)
+YU_ATTACKERS = _leg_attackers(_YU_STEPS)
+BOK_ATTACKERS = _grid(_bok_attackers)
+RAYS = _grid(_rays)
+PALACE_LINES = _grid(_palace_lines)
+PO_CORNER_ATTACKERS = {team: _po_corner_attackers(team) for team in TEAMS}
+FORWARD_DIR = {'초': -1, '한': 1}
+
+def _invert(attackers):
+    """Turns a per-target attacker table into a per-source one: (target, *rest) tuples."""
+    moves = [[[] for _ in range(BOARD_WIDTH_CELLS)] for _ in range(BOARD_HEIGHT_CELLS)]
+    for y in range(BOARD_HEIGHT_CELLS):
+        for x in range(BOARD_WIDTH_CELLS):
+            for sy, sx, *rest in attackers[y][x]:
+                moves[sy][sx].append((y, x, *rest))
+    return [[tuple(targets) for targets in row] for row in moves]
+
+# The same patterns seen from the moving piece, for generating captures.
+STEP_TARGETS = {team: _invert(STEP_ATTACKERS[team]) for team in TEAMS}
+MA_TARGETS = _invert(MA_ATTACKERS)
+SANG_TARGETS = _invert(SANG_ATTACKERS)
+YU_TARGETS = _invert(YU_ATTACKERS)
+BOK_TARGETS = _invert(BOK_ATTACKERS)
+PO_CORNER_TARGETS = {team: _invert([[tuple((oy, ox, cy, cx) for cy, cx, oy, ox in cell) for cell in row]
+                                    for row in PO_CORNER_ATTACKERS[team]]) for team in TEAMS}
+
+# Jeon may not enter (or slide through) either inner area; main palaces sit inside them.
+JEON_RESTRICTED = _grid(lambda y, x: any(in_zone(y, x, t, INNER | MAIN_PALACE) for t in TEAMS))
+# Hu of a team never starts from its own outer-outer area, and never lands there,
+# in the opponent's main palace or in the opponent's inner area.
+HU_IMMOBILE = {team: _grid(lambda y, x, t=team: in_zone(y, x, t, OUTER_OUTER)) for team in TEAMS}
+HU_BLOCKED = {
+    team: _grid(lambda y, x, t=team, o=opp: in_zone(y, x, t, OUTER_OUTER) or in_zone(y, x, o, INNER | MAIN_PALACE))
+    for team, opp in (('초', '한'), ('한', '초'))
+}
+
+# --- Compact Move History ---
+# Each ply is one 64-bit integer: the squares, the moving and captured piece codes, and the
+# flags make_move overwrites (so a move can be taken back without any other record).
+#   bits  0-7  from index          8-15 to index           16-20 mover code      21-25 captured code
+#   bit  26    mover had_moved    27-29 mover captured_general_group code (before the move)
+#   bit  30    captured has_moved 31-32 captured general_group code   33-35 captured captured_general_group code
+#   bits 36-41 deactivated_groups before the move, one bit per CAPTURED_GROUP_KEYS entry
+#   bits 42-43 whether the '초_중앙' / '한_중앙' keys were present in deactivated_groups at all
+KEYFRAME_INTERVAL = 32
+_OPTIONAL_GROUP_KEYS = ('초_중앙', '한_중앙')
+
+MoveRecord = namedtuple('MoveRecord', 'ply team piece from_pos to_pos captured notation')
+
+
+def pack_move(from_idx, to_idx, mover, captured, deactivated_groups):
+    """Packs a move about to be played; mover/captured are the pieces (captured may be None)."""
+    packed = from_idx | to_idx << 8 | mover.code << 16 | mover.has_moved << 26 \
+        | CAPTURED_GROUP_CODES.get(mover.captured_general_group, 0) << 27
+    if captured:
+        packed |= captured.code << 21 | captured.has_moved << 30 | GROUP_CODES[captured.general_group] << 31 \
+            | CAPTURED_GROUP_CODES.get(captured.captured_general_group, 0) << 33
+        for bit, key in enumerate(CAPTURED_GROUP_KEYS):
+            if deactivated_groups.get(key): packed |= 1 << (36 + bit)
+        for bit, key in enumerate(_OPTIONAL_GROUP_KEYS):
+            if key in deactivated_groups: packed |= 1 << (42 + bit)
+    return packed
+
+
+def unpack_deactivated(packed):
+    """The deactivated_groups dict as it was before a packed capture."""
+    groups = {key: bool(packed >> (36 + CAPTURED_GROUP_KEYS.index(key)) & 1) for key in DEACTIVATED_GROUP_KEYS}
+    for bit, key in enumerate(_OPTIONAL_GROUP_KEYS):
+        if packed >> (42 + bit) & 1: groups[key] = bool(packed >> (36 + CAPTURED_GROUP_KEYS.index(key)) & 1)
+    return groups
+
+
+def move_squares(packed):
+    """(from_pos, to_pos) of a packed move."""
+    from_y, from_x = divmod(packed & 0xFF, BOARD_WIDTH_CELLS)
+    to_y, to_x = divmod(packed >> 8 & 0xFF, BOARD_WIDTH_CELLS)
+    return SQUARE_POSITIONS[from_y][from_x], SQUARE_POSITIONS[to_y][to_x]
+
+
+def move_notation(from_pos, to_pos):
+    return (f"{chr(ord('a') + from_pos[1])}{BOARD_HEIGHT_CELLS - from_pos[0]}"
+            f"{chr(ord('a') + to_pos[1])}{BOARD_HEIGHT_CELLS - to_pos[0]}")
+
+
+class MoveHistory:
+    """The moves of a game, packed as above, with a GameState.to_snapshot keyframe taken
+    every KEYFRAME_INTERVAL plies. Indexing and iteration give MoveRecord tuples; use
+    GameState.position_at to rebuild an earlier position.
+
+    Moves taken back with pop() wait on a redo stack until a different move is appended."""
+    __slots__ = ('_moves', '_keyframes', '_redo')
+
+    def __init__(self):
+        self._moves = array('Q')
+        self._keyframes = [] # _keyframes[i] is the position before ply i * KEYFRAME_INTERVAL + 1
+        self._redo = array('Q') # most recently undone move last
+
+    def __len__(self):
+        return len(self._moves)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(len(self._moves)))]
+        if index < 0: index += len(self._moves)
+        if not 0 <= index < len(self._moves): raise IndexError('move history index out of range')
+        return self._record(index)
+
+    def __iter__(self):
+        return (self._record(i) for i in range(len(self._moves)))
+
+    def _record(self, index):
+        packed = self._moves[index]
+        from_pos, to_pos = move_squares(packed)
+        mover = packed >> 16 & 0x1F
+        captured = packed >> 21 & 0x1F
+        return MoveRecord(
+            index + 1, '한' if mover > TEAM_CODE_OFFSET else '초', CODE_PIECE_CLASSES[mover].korean_name,
+            from_pos, to_pos, CODE_PIECE_CLASSES[captured].korean_name if captured else None,
+            move_notation(from_pos, to_pos))
+
+    def packed(self, index):
+        return self._moves[index]
+
+    def needs_keyframe(self):
+        """True when the position about to be moved from should be kept as a keyframe."""
+        return len(self._moves) == len(self._keyframes) * KEYFRAME_INTERVAL
+
+    def append(self, packed, keyframe=None):
+        if keyframe is not None: self._keyframes.append(keyframe)
+        self._moves.append(packed)
+        if self._redo:
+            # Replaying the undone move keeps the rest of the redo line; anything else ends it.
+            if self._redo[-1] == packed: self._redo.pop()
+            else: del self._redo[:]
+
+    def pop(self):
+        """Removes the last move onto the redo stack and returns it packed."""
+        packed = self._moves.pop()
+        self._redo.append(packed)
+        del self._keyframes[len(self._moves) // KEYFRAME_INTERVAL + 1:]
+        return packed
+
+    @property
+    def redo_count(self):
+        return len(self._redo)
+
+    def clear_redo(self):
+        del self._redo[:]
+
+    def next_redo(self):
+        """The packed move redo() would play, or None."""
+        return self._redo[-1] if self._redo else None
+
+    def keyframe_before(self, ply):
+        """(keyframe_ply, snapshot) of the latest keyframe at or before ply."""
+        index = min(ply // KEYFRAME_INTERVAL, len(self._keyframes) - 1)
+        return index * KEYFRAME_INTERVAL, self._keyframes[index]
+
+    def nbytes(self):
+        """Approximate memory held: the packed moves plus the FEN text of the keyframes."""
+        return self._moves.itemsize * (len(self._moves) + len(self._redo)) + sum(len(keyframe['fen']) for keyframe in self._keyframes)
+
+    @property
+    def keyframes(self):
+        """The keyframe snapshots, oldest first (read only)."""
+        return self._keyframes
+
+    @classmethod
+    def restore(cls, packed_moves, keyframes):
+        """Rebuilds a history from its packed moves and keyframes, e.g. as a store saved them."""
+        history = cls()
+        history._moves.extend(packed_moves)
+        history._keyframes.extend(keyframes)
+        return history
+
+    def copy(self):
+        clone = MoveHistory.__new__(MoveHistory)
+        clone._moves = array('Q', self._moves)
+        clone._keyframes = list(self._keyframes) # snapshots are never modified
+        clone._redo = array('Q', self._redo)
+        return clone
+
 # --- GameState Class (from main.py, refactored) ---
 
 class GameState:
+    _profiler = None # the ksh_profiling.Profiler measuring this game, if any
+    # Legal destinations per from-square, valid while version is unchanged. With
+    # precompute_moves, move_piece fills it for the whole side to move in one batch.
+    _move_memo = (None, None) # (version, {from_pos: [to_pos, ...]})
+    precompute_moves = False
+
     def __init__(self, initial_fen=FEN):
         self.BOARD_WIDTH_CELLS = BOARD_WIDTH_CELLS
         self.BOARD_HEIGHT_CELLS = BOARD_HEIGHT_CELLS
         self._initialize_board_constants()
+        self.version = 0 # bumped on every real change to the position; never by selection or search
         self._initialize_game_variables(initial_fen)
 
     def _initialize_board_constants(self):
-        self.palaces = {
-            '한': (1, 6, 3, 8), '초': (10, 6, 12, 8),
-            '한_좌': (1, 0, 3, 2), '한_우': (1, 12, 3, 14),
-            '초_좌': (10, 0, 12, 2), '초_우': (10, 12, 12, 14),
-        }
-        self.palace_diagonal_paths = {
-            '한': [((1,6),(2,7)),((2,7),(3,8)),((2,7),(1,6)),((3,8),(2,7)),((1,8),(2,7)),((2,7),(3,6)),((2,7),(1,8)),((3,6),(2,7))],
-            '초': [((10,6),(11,7)),((11,7),(12,8)),((11,7),(10,6)),((12,8),(11,7)),((10,8),(11,7)),((11,7),(12,6)),((11,7),(10,8)),((12,6),(11,7))],
-            '한_좌': [((1,0),(2,1)),((2,1),(3,2)),((2,1),(1,0)),((3,2),(2,1)),((1,2),(2,1)),((2,1),(3,0)),((2,1),(1,2)),((3,0),(2,1))],
-            '한_우': [((1,12),(2,13)),((2,13),(3,14)),((2,13),(1,12)),((3,14),(2,13)),((1,14),(2,13)),((2,13),(3,12)),((2,13),(1,14)),((3,12),(2,13))],
-            '초_좌': [((10,0),(11,1)),((11,1),(12,2)),((11,1),(10,0)),((12,2),(11,1)),((10,2),(11,1)),((11,1),(12,0)),((11,1),(10,2)),((12,0),(11,1))],
-            '초_우': [((10,12),(11,13)),((11,13),(12,14)),((11,13),(10,12)),((12,14),(11,13)),((10,14),(11,13)),((11,13),(12,12)),((11,13),(10,14)),((12,12),(11,13))],
-        }
-        self.inner_area = {'한': (1, 4, 3, 10), '초': (10, 4, 12, 10)}
-        self.outer_area_bounds = {'한': (0, 3, 4, 11), '초': (9, 3, 13, 11)}
+        self.palaces = PALACES
+        self.palace_diagonal_paths = PALACE_DIAGONAL_PATHS
+        self.inner_area = INNER_AREA
+        self.outer_area_bounds = OUTER_AREA_BOUNDS
 
     def _initialize_game_variables(self, fen):
-        self.board_state = self.parse_fen(fen)
+        self._load_board(self.parse_fen(fen))
+        self._start_game()
+
+    def _start_game(self):
+        """Sets up a fresh game, 초 to move, on the board already loaded."""
         self.current_turn = '초'
         self.selected_pos = None # Replaces selected_piece
         self.valid_moves = []
         self.game_over = False
         self.winner = None
-        self.deactivated_groups = {'초_좌': False, '초_우': False, '한_좌': False, '한_우': False}
-        self.move_history = []
+        self.end_reason = None # 'su_captured' | 'checkmate' | 'stalemate'
+        self.deactivated_groups = dict.fromkeys(DEACTIVATED_GROUP_KEYS, False)
+        self.move_history = MoveHistory()
         self.in_check_team = None
         self.checked_su_pos = None
+        self.zobrist_key = self.compute_zobrist_key()
+        self.version += 1
+
+    def _load_board(self, board):
+        """Installs a piece grid and rebuilds the compact arrays from it.
+
+        The Zobrist key is left at zero; callers recompute it once turn and groups are set.
+        """
+        size = self.BOARD_HEIGHT_CELLS * self.BOARD_WIDTH_CELLS
+        self.board_state = board
+        self.zobrist_key = 0
+        self.squares = squares = bytearray(size)
+        self.moved_flags = moved_flags = bytearray(size)
+        self.group_flags = group_flags = bytearray(size)
+        self.captured_group_flags = captured_group_flags = bytearray(size)
+        self._fen_rows = [None] * self.BOARD_HEIGHT_CELLS # per row: (row bytes, piece, moved, group)
+        self._fen_dirty_rows = set(range(self.BOARD_HEIGHT_CELLS))
+        self._fen_cache = None
+        idx = 0
+        for row in board:
+            for piece in row:
+                if piece:
+                    squares[idx] = piece.code
+                    moved_flags[idx] = piece.has_moved
+                    group_flags[idx] = GROUP_CODES.get(piece.general_group, 0)
+                    captured_group_flags[idx] = CAPTURED_GROUP_CODES.get(piece.captured_general_group, 0)
+                idx += 1
+
+    def _load_arrays(self, squares, moved_flags, group_flags):
+        """Installs the compact arrays and rebuilds the piece grid from them, as _load_board the other way round."""
+        size = self.BOARD_HEIGHT_CELLS * self.BOARD_WIDTH_CELLS
+        self.zobrist_key = 0
+        self.squares = squares
+        self.moved_flags = moved_flags
+        self.group_flags = group_flags
+        self.captured_group_flags = bytearray(size)
+        self._fen_rows = [None] * self.BOARD_HEIGHT_CELLS
+        self._fen_dirty_rows = set(range(self.BOARD_HEIGHT_CELLS))
+        self._fen_cache = None
+        self.board_state = self._board_from_arrays()
+
+    def _sync_square(self, y, x):
+        """Writes the piece currently at (y, x) into the compact arrays."""
+        idx = y * self.BOARD_WIDTH_CELLS + x
+        piece = self.board_state[y][x]
+        squares, moved_flags, group_flags, captured_group_flags = self.squares, self.moved_flags, self.group_flags, self.captured_group_flags
+        key = self.zobrist_key ^ ZOBRIST_PIECES[squares[idx]][idx] ^ ZOBRIST_MOVED[moved_flags[idx]][idx] \
+            ^ ZOBRIST_GROUPS[group_flags[idx]][idx] ^ ZOBRIST_CAPTURED_GROUPS[captured_group_flags[idx]][idx]
+        if piece is None:
+            squares[idx] = 0
+            moved_flags[idx] = 0
+            group_flags[idx] = 0
+            captured_group_flags[idx] = 0
+        else:
+            squares[idx] = piece.code
+            moved_flags[idx] = piece.has_moved
+            group_flags[idx] = GROUP_CODES.get(piece.general_group, 0)
+            captured_group_flags[idx] = CAPTURED_GROUP_CODES.get(piece.captured_general_group, 0)
+            key ^= ZOBRIST_PIECES[squares[idx]][idx] ^ ZOBRIST_MOVED[moved_flags[idx]][idx] \
+                ^ ZOBRIST_GROUPS[group_flags[idx]][idx] ^ ZOBRIST_CAPTURED_GROUPS[captured_group_flags[idx]][idx]
+        self.zobrist_key = key
+        self._fen_dirty_rows.add(y)
+
+    def compute_zobrist_key(self):
+        """Computes the Zobrist key of the position from scratch."""
+        key = 0
+        for idx, code in enumerate(self.squares):
+            if not code: continue
+            key ^= ZOBRIST_PIECES[code][idx] ^ ZOBRIST_MOVED[self.moved_flags[idx]][idx] \
+                ^ ZOBRIST_GROUPS[self.group_flags[idx]][idx] ^ ZOBRIST_CAPTURED_GROUPS[self.captured_group_flags[idx]][idx]
+        if self.current_turn == '한': key ^= ZOBRIST_SIDE
+        return key ^ zobrist_deactivated_key(self.deactivated_groups)
+
+    def switch_turn(self):
+        """Hands the move to the other side, keeping the Zobrist key in step."""
+        self.current_turn = '한' if self.current_turn == '초' else '초'
+        self.zobrist_key ^= ZOBRIST_SIDE
+
+    def _board_from_arrays(self):
+        """Rebuilds the piece grid from the compact arrays."""
+        width = self.BOARD_WIDTH_CELLS
+        squares, moved_flags, group_flags, captured_group_flags = self.squares, self.moved_flags, self.group_flags, self.captured_group_flags
+        board = []
+        for y in range(self.BOARD_HEIGHT_CELLS):
+            row = [None] * width
+            positions = SQUARE_POSITIONS[y]
+            idx = y * width
+            for x in range(width):
+                code = squares[idx]
+                if code:
+                    piece = CODE_PIECE_CLASSES[code]('한' if code > TEAM_CODE_OFFSET else '초', positions[x])
+                    piece.has_moved = bool(moved_flags[idx])
+                    piece.general_group = GROUP_NAMES[group_flags[idx]]
+                    captured_group = captured_group_flags[idx]
+                    if captured_group: piece.captured_general_group = CAPTURED_GROUP_KEYS[captured_group - 1]
+                    row[x] = piece
+                idx += 1
+            board.append(row)
+        return board
+
+    def position_bytes(self):
+        """Returns the position (pieces, flags, side to move, deactivated groups) as one bytes key."""
+        groups = bytes(self.deactivated_groups.get(key, False) for key in CAPTURED_GROUP_KEYS)
+        turn = b'\x00' if self.current_turn == '초' else b'\x01'
+        return bytes(self.squares) + bytes(self.moved_flags) + bytes(self.group_flags) + bytes(self.captured_group_flags) + turn + groups
+
+    def copy(self):
+        """Returns an independent GameState, rebuilding its pieces from the compact arrays."""
+        clone = GameState.__new__(GameState)
+        clone.BOARD_WIDTH_CELLS = self.BOARD_WIDTH_CELLS
+        clone.BOARD_HEIGHT_CELLS = self.BOARD_HEIGHT_CELLS
+        clone._initialize_board_constants()
+        clone.squares = bytearray(self.squares)
+        clone.moved_flags = bytearray(self.moved_flags)
+        clone.group_flags = bytearray(self.group_flags)
+        clone.captured_group_flags = bytearray(self.captured_group_flags)
+        clone.board_state = clone._board_from_arrays()
+        clone.current_turn = self.current_turn
+        clone.selected_pos = self.selected_pos
+        clone.valid_moves = list(self.valid_moves)
+        clone.game_over = self.game_over
+        clone.winner = self.winner
+        clone.end_reason = self.end_reason
+        clone.deactivated_groups = self.deactivated_groups.copy()
+        clone.move_history = self.move_history.copy()
+        clone.in_check_team = self.in_check_team
+        clone.checked_su_pos = self.checked_su_pos
+        clone.zobrist_key = self.zobrist_key
+        clone.version = self.version
+        clone._fen_rows = list(self._fen_rows)
+        clone._fen_dirty_rows = set(self._fen_dirty_rows)
+        clone._fen_cache = self._fen_cache
+        return clone
 
     def reset(self):
         self._initialize_game_variables(FEN)
 
     def parse_fen(self, fen_string):
-        board = [[None for _ in range(self.BOARD_WIDTH_CELLS)] for _ in range(self.BOARD_HEIGHT_CELLS)]
+        """Builds the piece grid in one pass over each FEN part.
+
+        Each row is walked character by character straight onto the board: digit runs are
+        summed as they are read and each piece letter is one table lookup, with no
+        intermediate token list (expand_fen_row is the same walk for callers that want one).
+        """
+        width = self.BOARD_WIDTH_CELLS
+        height = self.BOARD_HEIGHT_CELLS
+        board = [[None] * width for _ in range(height)]
         parts = fen_string.split('|')
-        piece_fen = parts[0]
         moved_fen = parts[1] if len(parts) > 1 else None
         group_fen = parts[2] if len(parts) > 2 else None
-        rows = piece_fen.split('/')
-        for y, row_str in enumerate(rows):
-            if y >= self.BOARD_HEIGHT_CELLS: continue
-            x = 0
-            i = 0
-            while i < len(row_str):
-                if x >= self.BOARD_WIDTH_CELLS: break
-                char = row_str[i]
-                if char.isdigit():
-                    num_str = ""
-                    j = i
-                    while j < len(row_str) and row_str[j].isdigit():
-                        num_str += row_str[j]
-                        j += 1
-                    x += int(num_str)
-                    i = j
-                else:
-                    team = '한' if char.isupper() else '초'
-                    piece_class = PIECE_CLASS_MAP.get(char.lower())
-                    if piece_class:
-                        piece = piece_class(team, (y, x))
-                        if not group_fen:
-                            if x < 4: piece.general_group = '좌'
-                            elif x > 10: piece.general_group = '우'
-                            else: piece.general_group = '중앙'
-                        board[y][x] = piece
-                    x += 1
-                    i += 1
+        digits, pieces = FEN_DIGITS, FEN_CHAR_PIECES
+        for y, row_str in enumerate(parts[0].split('/')[:height]):
+            row = board[y]
+            positions = SQUARE_POSITIONS[y]
+            x = run = 0
+            for char in row_str:
+                digit = digits.get(char)
+                if digit is not None:
+                    run = run * 10 + digit
+                    continue
+                x += run
+                run = 0
+                if x >= width: break
+                piece_info = pieces.get(char)
+                if piece_info is not None:
+                    piece = piece_info[0](piece_info[1], positions[x])
+                    if not group_fen: piece.general_group = DEFAULT_GROUPS[x]
+                    row[x] = piece
+                x += 1
         if moved_fen:
-            moved_rows = moved_fen.split('/')
-            for y, row_str in enumerate(moved_rows):
-                if y >= self.BOARD_HEIGHT_CELLS: continue
-                x = 0
-                i = 0
-                while i < len(row_str):
-                    if x >= self.BOARD_WIDTH_CELLS: break
-                    char = row_str[i]
-                    if char.isdigit():
-                        num_str = ""
-                        j = i
-                        while j < len(row_str) and row_str[j].isdigit():
-                            num_str += row_str[j]
-                            j += 1
-                        x += int(num_str)
-                        i = j
-                    else:
-                        if board[y][x]: board[y][x].has_moved = True if char == 'm' else False
-                        x += 1
-                        i += 1
+            for y, row_str in enumerate(moved_fen.split('/')[:height]):
+                row = board[y]
+                x = run = 0
+                for char in row_str:
+                    digit = digits.get(char)
+                    if digit is not None:
+                        run = run * 10 + digit
+                        continue
+                    x += run
+                    run = 0
+                    if x >= width: break
+                    piece = row[x]
+                    if piece is not None: piece.has_moved = char == 'm'
+                    x += 1
         if group_fen:
-            group_rows = group_fen.split('/')
-            for y, row_str in enumerate(group_rows):
-                if y >= self.BOARD_HEIGHT_CELLS: continue
-                x = 0
-                i = 0
-                while i < len(row_str):
-                    if x >= self.BOARD_WIDTH_CELLS: break
-                    char = row_str[i]
-                    if char.isdigit():
-                        num_str = ""
-                        j = i
-                        while j < len(row_str) and row_str[j].isdigit():
-                            num_str += row_str[j]
-                            j += 1
-                        x += int(num_str)
-                        i = j
-                    else:
-                        if board[y][x]:
-                            if char == 'L': board[y][x].general_group = '좌'
-                            elif char == 'R': board[y][x].general_group = '우'
-                            elif char == 'C': board[y][x].general_group = '중앙'
-                        x += 1
-                        i += 1
+            for y, row_str in enumerate(group_fen.split('/')[:height]):
+                row = board[y]
+                x = run = 0
+                for char in row_str:
+                    digit = digits.get(char)
+                    if digit is not None:
+                        run = run * 10 + digit
+                        continue
+                    x += run
+                    run = 0
+                    if x >= width: break
+                    piece = row[x]
+                    if piece is not None and char in FEN_GROUP_NAMES: piece.general_group = FEN_GROUP_NAMES[char]
+                    x += 1
         return board
-        
+
+    @classmethod
+    def from_fens(cls, fens):
+        """Builds a GameState for each FEN, e.g. the positions of a stored move history.
+
+        The batch is decoded straight into the compact arrays one row at a time, and each
+        distinct row is decoded only once per batch (decode_fen_row), so consecutive
+        positions of a game, which differ in a row or two, share nearly all of the parsing.
+        A FEN that repeats within the batch is decoded once and copied.
+        """
+        height = BOARD_HEIGHT_CELLS
+        games = []
+        decoded = {}
+        rows = {} # (piece row, moved row, group row) -> decode_fen_row()
+        for fen in fens:
+            game = decoded.get(fen)
+            if game is not None:
+                games.append(game.copy())
+                continue
+            parts = fen.split('|')
+            piece_rows = parts[0].split('/')[:height]
+            moved_rows = parts[1].split('/')[:height] if len(parts) > 1 and parts[1] else []
+            group_rows = parts[2].split('/')[:height] if len(parts) > 2 and parts[2] else None
+            squares, moved_flags, group_flags = bytearray(), bytearray(), bytearray()
+            for y in range(height):
+                row_key = (
+                    piece_rows[y] if y < len(piece_rows) else _NO_FEN_ROW,
+                    moved_rows[y] if y < len(moved_rows) else _NO_FEN_ROW,
+                    None if group_rows is None else group_rows[y] if y < len(group_rows) else _NO_FEN_ROW,
+                )
+                decoded_row = rows.get(row_key)
+                if decoded_row is None:
+                    decoded_row = rows[row_key] = decode_fen_row(*row_key)
+                row_squares, row_moved, row_groups = decoded_row
+                squares += row_squares
+                moved_flags += row_moved
+                group_flags += row_groups
+            game = cls.__new__(cls)
+            game.BOARD_WIDTH_CELLS = BOARD_WIDTH_CELLS
+            game.BOARD_HEIGHT_CELLS = BOARD_HEIGHT_CELLS
+            game._initialize_board_constants()
+            game.version = 0
+            game._load_arrays(squares, moved_flags, group_flags)
+            game._start_game()
+            decoded[fen] = game
+            games.append(game)
+        return games
+
+    def to_snapshot(self):
+        """Returns a JSON-serializable record of the position that from_snapshot restores exactly.
+
+        Besides the FEN it keeps the captured Jang group each piece carries, the side to move,
+        the deactivated groups and the result. Selection and move_history are not included.
+        """
+        return {
+            'fen': self.generate_fen(),
+            'captured_groups': [[idx, code] for idx, code in enumerate(self.captured_group_flags) if code],
+            'turn': self.current_turn,
+            'deactivated_groups': dict(self.deactivated_groups),
+            'game_over': self.game_over,
+            'winner': self.winner,
+            'end_reason': self.end_reason,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        game = cls(snapshot['fen'])
+        for idx, code in snapshot['captured_groups']:
+            y, x = divmod(idx, game.BOARD_WIDTH_CELLS)
+            game.board_state[y][x].captured_general_group = CAPTURED_GROUP_KEYS[code - 1]
+            game.captured_group_flags[idx] = code
+        game.current_turn = snapshot['turn']
+        game.deactivated_groups.update(snapshot['deactivated_groups'])
+        game.game_over = snapshot['game_over']
+        game.winner = snapshot['winner']
+        game.end_reason = snapshot['end_reason']
+        game._refresh_check()
+        game.zobrist_key = game.compute_zobrist_key()
+        game.version += 1
+        return game
+
+    def position_at(self, ply):
+        """Returns a new GameState for the position after the first `ply` moves of move_history.
+
+        It is rebuilt from the nearest earlier keyframe by replaying the moves in between, so
+        its own move_history only starts at that keyframe.
+        """
+        history = self.move_history
+        if not 0 <= ply <= len(history): raise IndexError('ply out of range')
+        if not len(history):
+            game = self.copy()
+            game.selected_pos, game.valid_moves = None, []
+            return game
+        keyframe_ply, snapshot = history.keyframe_before(ply)
+        game = GameState.from_snapshot(snapshot)
+        for index in range(keyframe_ply, ply):
+            game.move_piece(*move_squares(history.packed(index)))
+        return game
+
     def generate_fen(self):
-        piece_rows, moved_rows, group_rows = [], [], []
-        for r in range(self.BOARD_HEIGHT_CELLS):
-            empty_piece, empty_moved, empty_group = 0, 0, 0
-            row_piece, row_moved, row_group = "", "", ""
-            for c in range(self.BOARD_WIDTH_CELLS):
-                piece = self.board_state[r][c]
-                if piece is None:
-                    empty_piece += 1
-                    empty_moved += 1
-                    empty_group += 1
-                else:
-                    if empty_piece > 0: row_piece += str(empty_piece); empty_piece = 0
-                    fen_char = PIECE_FEN_MAP.get(piece.name)
-                    row_piece += fen_char.upper() if piece.team == '한' else fen_char.lower()
-                    if empty_moved > 0: row_moved += str(empty_moved); empty_moved = 0
-                    row_moved += 'm' if piece.has_moved else '-'
-                    if empty_group > 0: row_group += str(empty_group); empty_group = 0
-                    if piece.general_group == '좌': row_group += 'L'
-                    elif piece.general_group == '우': row_group += 'R'
-                    else: row_group += 'C'
-            if empty_piece > 0: row_piece += str(empty_piece)
-            if empty_moved > 0: row_moved += str(empty_moved)
-            if empty_group > 0: row_group += str(empty_group)
-            piece_rows.append(row_piece)
-            moved_rows.append(row_moved)
-            group_rows.append(row_group)
-        return f"{'/'.join(piece_rows)}|{'/'.join(moved_rows)}|{'/'.join(group_rows)}"
+        """Returns the three-part FEN, re-encoding only rows whose contents changed."""
+        if self._fen_dirty_rows:
+            width = self.BOARD_WIDTH_CELLS
+            changed = self._fen_cache is None
+            for y in self._fen_dirty_rows:
+                start = y * width
+                end = start + width
+                row_key = bytes(self.squares[start:end] + self.moved_flags[start:end] + self.group_flags[start:end])
+                cached = self._fen_rows[y]
+                if cached is None or cached[0] != row_key:
+                    self._fen_rows[y] = (row_key,) + self._encode_fen_row(start)
+                    changed = True
+            self._fen_dirty_rows.clear()
+            if changed:
+                rows = self._fen_rows
+                self._fen_cache = f"{'/'.join(r[1] for r in rows)}|{'/'.join(r[2] for r in rows)}|{'/'.join(r[3] for r in rows)}"
+        return self._fen_cache
+
+    def _encode_fen_row(self, start):
+        row_piece, row_moved, row_group = [], [], []
+        empty = 0
+        for idx in range(start, start + self.BOARD_WIDTH_CELLS):
+            code = self.squares[idx]
+            if not code:
+                empty += 1
+                continue
+            if empty:
+                run = str(empty)
+                row_piece.append(run); row_moved.append(run); row_group.append(run)
+                empty = 0
+            row_piece.append(CODE_FEN_CHARS[code])
+            row_moved.append('m' if self.moved_flags[idx] else '-')
+            row_group.append(GROUP_FEN_CHARS[self.group_flags[idx]])
+        if empty:
+            run = str(empty)
+            row_piece.append(run); row_moved.append(run); row_group.append(run)
+        return ''.join(row_piece), ''.join(row_moved), ''.join(row_group)
 
     def handle_click(self, pos):
         """A single method to handle any click, either selecting or moving."""
@@ -551,112 +1159,361 @@ class GameState:
             return
 
         # If clicking a valid piece of the current turn
-        group_key = f"{target_piece.team}_{target_piece.general_group}"
-        if target_piece.general_group != '중앙' and target_piece.name != 'Su' and self.deactivated_groups.get(group_key, False):
+        if self.is_piece_deactivated(target_piece):
             self.selected_pos = None
             self.valid_moves = []
             return
 
         self.selected_pos = (y,x)
-        piece_to_check = self.board_state[y][x]
-        
-        potential_moves = piece_to_check.get_valid_moves(self.board_state, self)
-        
-        truly_valid_moves = []
-        for move in potential_moves:
-            import copy
-            temp_board_state = copy.deepcopy(self.board_state)
-            
-            from_pos_temp = self.selected_pos
-            temp_board_state[move[0]][move[1]] = temp_board_state[from_pos_temp[0]][from_pos_temp[1]]
-            temp_board_state[from_pos_temp[0]][from_pos_temp[1]] = None
-
-            in_check, _ = self.is_su_in_check(self.current_turn, temp_board_state)
-            if not in_check:
-                truly_valid_moves.append(move)
-        
-        self.valid_moves = truly_valid_moves
+        self.valid_moves = self.legal_moves_from(self.selected_pos)
+
+    def legal_moves_from(self, from_pos):
+        """Legal destinations of the piece on from_pos, memoised until the position changes."""
+        memo = self._current_move_memo()
+        legal = memo.get(from_pos)
+        if legal is None:
+            piece = self.board_state[from_pos[0]][from_pos[1]]
+            legal = memo[from_pos] = self.filter_legal_moves(from_pos, self.get_piece_moves(piece))
+        return list(legal)
+
+    def precompute_legal_moves(self):
+        """Fills the move memo for every active piece of the side to move. Returns whether any can move."""
+        memo = self._current_move_memo()
+        team = self.current_turn
+        can_move = False
+        for row in self.board_state:
+            for piece in row:
+                if piece is None or piece.team != team or self.is_piece_deactivated(piece): continue
+                from_pos = piece.position
+                legal = memo.get(from_pos)
+                if legal is None:
+                    legal = memo[from_pos] = self.filter_legal_moves(from_pos, self.get_piece_moves(piece))
+                can_move = can_move or bool(legal)
+        return can_move
+
+    def _current_move_memo(self):
+        version, memo = self._move_memo
+        if version != self.version:
+            memo = {}
+            self._move_memo = (self.version, memo)
+        return memo
+
+    def get_piece_moves(self, piece):
+        """The piece's moves by its own rules, before the check filter."""
+        return piece.get_valid_moves(self.board_state, self)
+
+    def is_piece_deactivated(self, piece):
+        """A piece whose general (Jang) has been captured cannot move; Su and 중앙 pieces never are."""
+        if piece.general_group == '중앙' or piece.name == 'Su': return False
+        return self.deactivated_groups.get(f"{piece.team}_{piece.general_group}", False)
+
+    def iter_legal_moves(self):
+        """Lazily yields legal (from_pos, to_pos) pairs for the side to move.
 
+        Each candidate is checked only when requested, so callers can stop at the first one.
+        The board must not be changed while the generator is suspended.
+        """
+        team = self.current_turn
+        for row in self.board_state:
+            for piece in row:
+                if piece is None or piece.team != team or self.is_piece_deactivated(piece): continue
+                from_pos = piece.position
+                for to_pos in piece.get_valid_moves(self.board_state, self):
+                    if self.is_legal_move(from_pos, to_pos):
+                        yield from_pos, to_pos
+
+    def legal_moves(self):
+        """Returns every legal (from_pos, to_pos) pair for the side to move."""
+        if self.game_over: return []
+        return list(self.iter_legal_moves())
+
+    def has_legal_move(self):
+        """True as soon as one legal move is found for the side to move."""
+        return next(self.iter_legal_moves(), None) is not None
+
+    def perft(self, depth):
+        """Counts leaf nodes of the legal move tree to the given depth.
+
+        Capturing a Su ends the game, so such moves are counted as leaves.
+        """
+        if depth <= 0: return 1
+        moves = self.legal_moves()
+        if depth == 1: return len(moves)
+        nodes = 0
+        for from_pos, to_pos in moves:
+            captured_piece = self.board_state[to_pos[0]][to_pos[1]]
+            if captured_piece and captured_piece.name == 'Su':
+                nodes += 1
+                continue
+            undo = self.make_move(from_pos, to_pos)
+            self.switch_turn()
+            try:
+                nodes += self.perft(depth - 1)
+            finally:
+                self.switch_turn()
+                self.unmake_move(undo)
+        return nodes
+
+    def make_move(self, from_pos, to_pos):
+        """Applies a move to the board in place and returns a record for unmake_move.
+
+        Only the board itself is touched (pieces, has_moved, general-group capture
+        bookkeeping and deactivated_groups); turn, history and check state are left alone.
+        """
+        from_y, from_x = from_pos
+        to_y, to_x = to_pos
+        piece_to_move = self.board_state[from_y][from_x]
+        captured_piece = self.board_state[to_y][to_x]
+        undo = (from_pos, to_pos, piece_to_move, captured_piece, piece_to_move.has_moved,
+                piece_to_move.captured_general_group,
+                self.deactivated_groups.copy() if captured_piece else None, self.zobrist_key)
+        if captured_piece:
+            self.zobrist_key ^= zobrist_deactivated_key(self.deactivated_groups)
+            if captured_piece.name == 'Jang':
+                group_key = f"{captured_piece.team}_{captured_piece.general_group}"
+                self.deactivated_groups[group_key] = True
+                piece_to_move.captured_general_group = group_key
+            if captured_piece.captured_general_group:
+                self.deactivated_groups[captured_piece.captured_general_group] = False
+            self.zobrist_key ^= zobrist_deactivated_key(self.deactivated_groups)
+        self.board_state[to_y][to_x] = piece_to_move
+        self.board_state[from_y][from_x] = None
+        piece_to_move.position = SQUARE_POSITIONS[to_y][to_x]
+        piece_to_move.has_moved = True
+        self._sync_square(from_y, from_x)
+        self._sync_square(to_y, to_x)
+        return undo
+
+    def unmake_move(self, undo):
+        """Exactly reverts a move applied by make_move."""
+        from_pos, to_pos, piece_to_move, captured_piece, had_moved, captured_general_group, groups_before, key_before = undo
+        self.board_state[from_pos[0]][from_pos[1]] = piece_to_move
+        self.board_state[to_pos[0]][to_pos[1]] = captured_piece
+        piece_to_move.position = SQUARE_POSITIONS[from_pos[0]][from_pos[1]]
+        piece_to_move.has_moved = had_moved
+        piece_to_move.captured_general_group = captured_general_group
+        if groups_before is not None:
+            self.deactivated_groups.clear()
+            self.deactivated_groups.update(groups_before)
+        self._sync_square(*from_pos)
+        self._sync_square(*to_pos)
+        self.zobrist_key = key_before
+
+    def is_legal_move(self, from_pos, to_pos):
+        """Checks that the move would not leave the current side's Su in check."""
+        undo = self.make_move(from_pos, to_pos)
+        try:
+            in_check, _ = self.is_su_in_check(self.current_turn, self.board_state)
+        finally:
+            self.unmake_move(undo)
+        return not in_check
+
+    def filter_legal_moves(self, from_pos, moves):
+        """Drops the moves that would leave the current side's Su in check."""
+        return [move for move in moves if self.is_legal_move(from_pos, move)]
+
+    # Zone predicates: single lookups in the ksh_zones tables.
     def is_in_inner_area(self, pos, team):
-        y, x = pos
-        y1, x1, y2, x2 = self.inner_area[team]
-        return y1 <= y <= y2 and x1 <= x <= x2
+        return in_zone(pos[0], pos[1], team, INNER)
 
     def is_in_outer_area(self, pos, team):
-        y, x = pos
-        if not (0 <= y < self.BOARD_HEIGHT_CELLS and 0 <= x < self.BOARD_WIDTH_CELLS): return False
-        y1_outer, x1_outer, y2_outer, x2_outer = self.outer_area_bounds[team]
-        if not (y1_outer <= y <= y2_outer and x1_outer <= x <= x2_outer): return False
-        return not self.is_in_inner_area(pos, team)
+        return in_zone(pos[0], pos[1], team, OUTER)
 
     def is_in_outer_outer_area(self, pos, team):
-        y, x = pos
-        if not (0 <= y < self.BOARD_HEIGHT_CELLS and 0 <= x < self.BOARD_WIDTH_CELLS): return False
-        if not self.is_in_inner_area(pos, team) and not self.is_in_outer_area(pos, team):
-            if self.is_in_palace(pos, team, check_main_palace_only=True): return False
-            return True
-        return False
+        return in_zone(pos[0], pos[1], team, OUTER_OUTER)
 
     def is_in_palace(self, pos, team, check_main_palace_only=False, check_palace_key=None):
-        y, x = pos
-        palace_keys_to_check = [check_palace_key] if check_palace_key else []
-        if not palace_keys_to_check:
-            palace_keys_to_check.append(team)
-            if not check_main_palace_only:
-                palace_keys_to_check.extend([f"{team}_좌", f"{team}_우"])
-        
-        # A bit of a hack, but Cha and Hu can move along any palace lines
-        if self.selected_pos and not check_main_palace_only:
-             piece = self.board_state[self.selected_pos[0]][self.selected_pos[1]]
-             if piece and piece.name in ['Cha', 'Hu']:
-                 palace_keys_to_check.extend(['초', '한', '초_좌', '초_우', '한_좌', '한_우'])
-                 palace_keys_to_check = list(set(palace_keys_to_check))
-
-
-        for key in palace_keys_to_check:
-            if key not in self.palaces: continue
-            y1, x1, y2, x2 = self.palaces[key]
-            if y1 <= y <= y2 and x1 <= x <= x2: return True
-        return False
+        """Whether pos is in one of team's palaces (only the main one if check_main_palace_only),
+        or, given check_palace_key, in that palace whichever team it belongs to."""
+        if check_palace_key: return palace_at(*pos) == check_palace_key
+        return in_zone(pos[0], pos[1], team, MAIN_PALACE if check_main_palace_only else PALACE)
 
     def is_valid_palace_diagonal_move(self, r1, c1, r2, c2, team):
-        current_pos, new_pos = (r1, c1), (r2, c2)
-        
-        all_palace_keys = ['초', '한', '초_좌', '초_우', '한_좌', '한_우']
-        
-        for key in all_palace_keys:
-            # Check if both current_pos and new_pos are in THIS specific palace
-            y1, x1, y2, x2 = self.palaces[key]
-            current_in = y1 <= current_pos[0] <= y2 and x1 <= current_pos[1] <= x2
-            new_in = y1 <= new_pos[0] <= y2 and x1 <= new_pos[1] <= x2
+        return is_palace_diagonal_step(r1, c1, r2, c2)
 
-            if not (current_in and new_in):
-                continue 
+    def is_square_under_attack(self, square, attacking_team, board_state):
+        """Checks whether any piece of attacking_team could move onto square.
 
-            valid_segments = self.palace_diagonal_paths[key]
-            if (current_pos, new_pos) in valid_segments: return True
-        return False
+        Looks outward from the square through the precomputed attack tables, so only
+        the few squares an attacker could stand on are inspected.
+        """
+        y, x = square
+        if not (0 <= y < self.BOARD_HEIGHT_CELLS and 0 <= x < self.BOARD_WIDTH_CELLS): return False
 
-    def is_square_under_attack(self, square, attacking_team, board_state):
-        for r in range(self.BOARD_HEIGHT_CELLS):
-            for c in range(self.BOARD_WIDTH_CELLS):
-                piece = board_state[r][c]
-                if piece and piece.team == attacking_team:
-                    # Temporarily set selected_pos for context-dependent moves (like Cha in palace)
-                    original_selected_pos = self.selected_pos
-                    self.selected_pos = (r, c)
-                    
-                    attack_moves = []
-                    if piece.name in ['Su', 'Jang']: attack_moves = piece._get_base_moves(board_state, self)
-                    elif piece.name == 'Bok': attack_moves = piece._get_attack_range(board_state)
-                    else: attack_moves = piece.get_valid_moves(board_state, self)
-                    
-                    self.selected_pos = original_selected_pos # Restore
-                    
-                    if square in attack_moves: return True
+        # Bok's attack range does not care who stands on the target square.
+        for by, bx, p1y, p1x, p2y, p2x in BOK_ATTACKERS[y][x]:
+            piece = board_state[by][bx]
+            if piece and piece.team == attacking_team and piece.name == 'Bok' \
+                    and board_state[p1y][p1x] is None and board_state[p2y][p2x] is None:
+                return True
+
+        target = board_state[y][x]
+        if target and target.team == attacking_team: return False
+        target_name = target.name if target else None
+
+        for sy, sx in STEP_ATTACKERS[attacking_team][y][x]:
+            piece = board_state[sy][sx]
+            if piece and piece.team == attacking_team and piece.name in ('Su', 'Jang', 'Sa'): return True
+
+        forward_dir = FORWARD_DIR[attacking_team]
+        behind_y = y - forward_dir
+        if 0 <= behind_y < self.BOARD_HEIGHT_CELLS:
+            piece = board_state[behind_y][x]
+            if piece and piece.team == attacking_team and piece.name == 'Bo': return True
+        for sx in (x - 1, x + 1):
+            if not 0 <= sx < self.BOARD_WIDTH_CELLS: continue
+            piece = board_state[y][sx]
+            if piece and piece.team == attacking_team and piece.name in ('Bo', 'Gi'): return True
+            if 0 <= behind_y < self.BOARD_HEIGHT_CELLS:
+                piece = board_state[behind_y][sx]
+                if piece and piece.team == attacking_team and piece.name == 'Gi': return True
+
+        for sy, sx, ly, lx in MA_ATTACKERS[y][x]:
+            piece = board_state[sy][sx]
+            if piece and piece.team == attacking_team and piece.name == 'Ma' and board_state[ly][lx] is None: return True
+        for sy, sx, l1y, l1x, l2y, l2x in SANG_ATTACKERS[y][x]:
+            piece = board_state[sy][sx]
+            if piece and piece.team == attacking_team and piece.name == 'Sang' \
+                    and board_state[l1y][l1x] is None and board_state[l2y][l2x] is None:
+                return True
+        for sy, sx, ly, lx in YU_ATTACKERS[y][x]:
+            piece = board_state[sy][sx]
+            if piece and piece.team == attacking_team and piece.name == 'Yu' and board_state[ly][lx] is None: return True
+
+        hu_blocked = HU_BLOCKED[attacking_team][y][x]
+        hu_immobile = HU_IMMOBILE[attacking_team]
+        jeon_allowed = target_name != 'Jeon' and not JEON_RESTRICTED[y][x]
+
+        for ray in RAYS[y][x]:
+            jeon_open = jeon_allowed
+            screen_found = False
+            for i, (ry, rx) in enumerate(ray):
+                piece = board_state[ry][rx]
+                if piece is None:
+                    if jeon_open and JEON_RESTRICTED[ry][rx]: jeon_open = False
+                    continue
+                if not screen_found:
+                    if piece.team == attacking_team:
+                        name = piece.name
+                        if name == 'Cha': return True
+                        if name == 'Hu' and not hu_blocked and not hu_immobile[ry][rx]: return True
+                        if name == 'Jeon' and jeon_open: return True
+                        if name == 'Gi_L' and i < 2: return True
+                    # Po can neither jump over nor capture another Po.
+                    if piece.name == 'Po' or target_name == 'Po': break
+                    screen_found = True
+                else:
+                    if piece.team == attacking_team and piece.name == 'Po': return True
+                    break
+
+        for key, line in PALACE_LINES[y][x]:
+            for ry, rx in line:
+                piece = board_state[ry][rx]
+                if piece is None: continue
+                if piece.team == attacking_team:
+                    name = piece.name
+                    if name == 'Cha': return True
+                    if name == 'Hu' and not hu_blocked and not hu_immobile[ry][rx]: return True
+                    if name == 'Jeon' and key not in TEAMS and jeon_allowed: return True
+                break
+
+        if target_name != 'Po':
+            for cy, cx, oy, ox in PO_CORNER_ATTACKERS[attacking_team][y][x]:
+                piece = board_state[oy][ox]
+                if piece and piece.team == attacking_team and piece.name == 'Po':
+                    center = board_state[cy][cx]
+                    if center and center.name != 'Po': return True
         return False
 
+    def capture_moves(self):
+        """Pseudo-legal captures (from_pos, to_pos) of the side to move, before the own-Su check filter.
+
+        The same moves get_valid_moves would give onto enemy pieces, but each piece only
+        looks at the squares it could capture on (the first piece along each line, the
+        ends of its jumps) through the attack tables, so no quiet move is generated.
+        """
+        team = self.current_turn
+        opponent = '한' if team == '초' else '초'
+        board_state = self.board_state
+        check_deactivated = any(self.deactivated_groups.values())
+        captures = []
+        for row in board_state:
+            for piece in row:
+                if piece is None or piece.team != team: continue
+                if check_deactivated and self.is_piece_deactivated(piece): continue
+                y, x = from_pos = piece.position
+                name = piece.name
+                if name in ('Cha', 'Hu', 'Jeon', 'Gi_L'):
+                    if name == 'Hu' and HU_IMMOBILE[team][y][x]: continue
+                    for ray in RAYS[y][x]:
+                        for i, (ty, tx) in enumerate(ray):
+                            if name == 'Gi_L' and i == 2: break
+                            if name == 'Jeon' and JEON_RESTRICTED[ty][tx]: break
+                            target = board_state[ty][tx]
+                            if target is None: continue
+                            if target.team != team and not (name == 'Hu' and HU_BLOCKED[team][ty][tx]) \
+                                    and not (name == 'Jeon' and target.name == 'Jeon'):
+                                captures.append((from_pos, (ty, tx)))
+                            break
+                    if name == 'Gi_L': continue
+                    for key, line in PALACE_LINES[y][x]:
+                        if name == 'Jeon' and key in TEAMS: continue
+                        for ty, tx in line:
+                            target = board_state[ty][tx]
+                            if target is None: continue
+                            if target.team != team and not (name == 'Hu' and HU_BLOCKED[team][ty][tx]) \
+                                    and not (name == 'Jeon' and (target.name == 'Jeon' or JEON_RESTRICTED[ty][tx])):
+                                captures.append((from_pos, (ty, tx)))
+                            break
+                elif name == 'Po':
+                    for ray in RAYS[y][x]:
+                        screen_found = False
+                        for ty, tx in ray:
+                            target = board_state[ty][tx]
+                            if target is None: continue
+                            if target.name == 'Po': break
+                            if screen_found:
+                                if target.team != team: captures.append((from_pos, (ty, tx)))
+                                break
+                            screen_found = True
+                    for ty, tx, cy, cx in PO_CORNER_TARGETS[team][y][x]:
+                        center = board_state[cy][cx]
+                        target = board_state[ty][tx]
+                        if center and center.name != 'Po' and target and target.team != team and target.name != 'Po':
+                            captures.append((from_pos, (ty, tx)))
+                elif name in ('Su', 'Jang', 'Sa'):
+                    for ty, tx in STEP_TARGETS[team][y][x]:
+                        target = board_state[ty][tx]
+                        if target is None or target.team == team: continue
+                        if name != 'Sa' and self.is_square_under_attack((ty, tx), opponent, board_state): continue
+                        captures.append((from_pos, (ty, tx)))
+                elif name == 'Ma' or name == 'Yu':
+                    for ty, tx, ly, lx in (MA_TARGETS if name == 'Ma' else YU_TARGETS)[y][x]:
+                        target = board_state[ty][tx]
+                        if target is not None and target.team != team and board_state[ly][lx] is None:
+                            captures.append((from_pos, (ty, tx)))
+                elif name == 'Sang' or name == 'Bok':
+                    # Sang's two legs, or the two squares Bok's attack crosses, must be empty.
+                    for ty, tx, l1y, l1x, l2y, l2x in (SANG_TARGETS if name == 'Sang' else BOK_TARGETS)[y][x]:
+                        target = board_state[ty][tx]
+                        if target is not None and target.team != team and board_state[l1y][l1x] is None and board_state[l2y][l2x] is None:
+                            captures.append((from_pos, (ty, tx)))
+                else: # Bo and Gi step forward or sideways; Gi's forward steps are diagonal
+                    forward_y = y + FORWARD_DIR[team]
+                    targets = [(y, x - 1), (y, x + 1)]
+                    if name == 'Bo': targets.append((forward_y, x))
+                    else: targets += [(forward_y, x - 1), (forward_y, x + 1)]
+                    for ty, tx in targets:
+                        if not (0 <= ty < self.BOARD_HEIGHT_CELLS and 0 <= tx < self.BOARD_WIDTH_CELLS): continue
+                        target = board_state[ty][tx]
+                        if target is not None and target.team != team: captures.append((from_pos, (ty, tx)))
+        return captures
+
     def find_su_position(self, team, board_state):
+        if board_state is self.board_state:
+            # The live board is mirrored in squares, where one byte search finds the Su.
+            idx = self.squares.find(SU_CODES[team])
+            return divmod(idx, self.BOARD_WIDTH_CELLS) if idx >= 0 else None
         for r in range(self.BOARD_HEIGHT_CELLS):
             for c in range(self.BOARD_WIDTH_CELLS):
                 piece = board_state[r][c]
@@ -673,36 +1530,18 @@ class GameState:
     def move_piece(self, from_pos, to_pos):
         from_y, from_x = from_pos
         to_y, to_x = to_pos
-        fen_before = self.generate_fen()
         piece_to_move = self.board_state[from_y][from_x]
         captured_piece = self.board_state[to_y][to_x]
+        history = self.move_history
+        history.append(
+            pack_move(from_y * self.BOARD_WIDTH_CELLS + from_x, to_y * self.BOARD_WIDTH_CELLS + to_x,
+                      piece_to_move, captured_piece, self.deactivated_groups),
+            self.to_snapshot() if history.needs_keyframe() else None)
         if captured_piece and captured_piece.name == 'Su':
             self.game_over = True
             self.winner = piece_to_move.team
-        if captured_piece and captured_piece.name == 'Jang':
-            group_key = f"{captured_piece.team}_{captured_piece.general_group}"
-            self.deactivated_groups[group_key] = True
-            piece_to_move.captured_general_group = group_key
-        if captured_piece and captured_piece.captured_general_group:
-            self.deactivated_groups[captured_piece.captured_general_group] = False
-        self.board_state[to_y][to_x] = piece_to_move
-        self.board_state[from_y][from_x] = None
-        piece_to_move.position = to_pos
-        piece_to_move.has_moved = True
-        
-        fen_after = self.generate_fen()
-        deactivated_groups_after = self.deactivated_groups.copy()
-        from_alg = f"{chr(ord('a') + from_x)}{self.BOARD_HEIGHT_CELLS - from_y}"
-        to_alg = f"{chr(ord('a') + to_x)}{self.BOARD_HEIGHT_CELLS - to_y}"
-        notation = f"{from_alg}{to_alg}"
-        move_data = {
-            'team': piece_to_move.team, 'piece_korean_name': piece_to_move.korean_name,
-            'from_pos': from_pos, 'to_pos': to_pos, 'notation': notation,
-            'fen_before': fen_before, 'fen_after': fen_after,
-            'captured_piece_name': captured_piece.korean_name if captured_piece else None,
-            'deactivated_groups_after': deactivated_groups_after
-        }
-        self.move_history.append(move_data)
+            self.end_reason = 'su_captured'
+        self.make_move(from_pos, to_pos)
         
         # Clear selection state after move
         self.selected_pos = None
@@ -711,8 +1550,76 @@ class GameState:
         self.checked_su_pos = None
 
         if not self.game_over:
-            self.current_turn = '한' if self.current_turn == '초' else '초'
-            in_check, checked_su_pos = self.is_su_in_check(self.current_turn, self.board_state)
-            if in_check:
-                self.in_check_team = self.current_turn
-                self.checked_su_pos = checked_su_pos
\ No newline at end of file
+            self.switch_turn()
+            in_check = self._refresh_check()
+        self.version += 1
+        if not self.game_over:
+            # A side left without any legal move loses, whether it is in check or not.
+            if not (self.precompute_legal_moves() if self.precompute_moves else self.has_legal_move()):
+                self.game_over = True
+                self.winner = piece_to_move.team
+                self.end_reason = 'checkmate' if in_check else 'stalemate'
+
+    def _refresh_check(self):
+        """Sets in_check_team/checked_su_pos for the side to move and returns whether it is in check."""
+        in_check, checked_su_pos = self.is_su_in_check(self.current_turn, self.board_state)
+        self.in_check_team = self.current_turn if in_check else None
+        self.checked_su_pos = checked_su_pos if in_check else None
+        return in_check
+
+    def undo(self):
+        """Takes back the last move of move_history in place. Returns False if there is none.
+
+        The packed record restores the mover's flags, the captured piece and deactivated_groups
+        exactly; the move stays available to redo() until a different move is played.
+        """
+        history = self.move_history
+        if not len(history): return False
+        packed = history.pop()
+        from_pos, to_pos = move_squares(packed)
+        (from_y, from_x), (to_y, to_x) = from_pos, to_pos
+        piece = self.board_state[to_y][to_x]
+        piece.position = from_pos
+        piece.has_moved = bool(packed >> 26 & 1)
+        group = packed >> 27 & 7
+        piece.captured_general_group = CAPTURED_GROUP_KEYS[group - 1] if group else None
+        self.board_state[from_y][from_x] = piece
+        captured = None
+        captured_code = packed >> 21 & 0x1F
+        if captured_code:
+            captured = CODE_PIECE_CLASSES[captured_code]('한' if captured_code > TEAM_CODE_OFFSET else '초', to_pos)
+            captured.has_moved = bool(packed >> 30 & 1)
+            captured.general_group = GROUP_NAMES[packed >> 31 & 3]
+            group = packed >> 33 & 7
+            captured.captured_general_group = CAPTURED_GROUP_KEYS[group - 1] if group else None
+            self.zobrist_key ^= zobrist_deactivated_key(self.deactivated_groups)
+            self.deactivated_groups.clear()
+            self.deactivated_groups.update(unpack_deactivated(packed))
+            self.zobrist_key ^= zobrist_deactivated_key(self.deactivated_groups)
+        self.board_state[to_y][to_x] = captured
+        self._sync_square(from_y, from_x)
+        self._sync_square(to_y, to_x)
+        if self.current_turn != piece.team: self.switch_turn()
+        # Nothing is played after the game ends, so the position before any move was still open.
+        self.game_over = False
+        self.winner = None
+        self.end_reason = None
+        self.selected_pos = None
+        self.valid_moves = []
+        self._refresh_check()
+        self.version += 1
+        return True
+
+    def redo(self):
+        """Plays the most recently undone move again. Returns False if there is none."""
+        packed = self.move_history.next_redo()
+        if packed is None: return False
+        self.move_piece(*move_squares(packed))
+        return True
+
+    def seek(self, ply):
+        """Steps to the position after `ply` moves with undo()/redo(), one move per step."""
+        history = self.move_history
+        if not 0 <= ply <= len(history) + history.redo_count: raise IndexError('ply out of range')
+        while len(history) > ply: self.undo()
+        while len(history) < ply: self.redo()
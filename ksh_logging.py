@@ -0,0 +1,90 @@
+"""Structured, non-blocking logging for the server.
+
+Records from the 'ksh' logger tree go through a QueueHandler, so a handler only pays for
+putting the record on a queue; a QueueListener thread formats them as JSON lines and
+writes them out. Structured data rides in extra={'fields': {...}}.
+
+Per-click debug records are sampled (click_sampled()), and both the level and the sample
+rate can be changed while the server runs.
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+ROOT_LOGGER = 'ksh'
+
+_listener = None
+_click_sample_rate = 0.0
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg and the record's fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields: entry.update(fields)
+        if record.exc_info: entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def configure_logging(level='INFO', click_sample_rate=0.0, stream=None):
+    """Routes the 'ksh' loggers through a queue to a JSON stream handler (stderr by default)."""
+    global _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    if _listener is not None:
+        _listener.stop()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter())
+    records = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    set_level(level)
+    set_click_sample_rate(click_sample_rate)
+
+
+def set_level(level):
+    """Changes the level of every 'ksh' logger at once; level is a name or a logging constant."""
+    logging.getLogger(ROOT_LOGGER).setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def set_click_sample_rate(rate):
+    global _click_sample_rate
+    _click_sample_rate = min(max(float(rate), 0.0), 1.0)
+
+
+def logging_settings():
+    return {
+        'level': logging.getLevelName(logging.getLogger(ROOT_LOGGER).getEffectiveLevel()),
+        'click_sample_rate': _click_sample_rate,
+    }
+
+
+def click_sampled(logger):
+    """True if this click should be logged in detail: DEBUG is on and the click falls in the sample."""
+    return logger.isEnabledFor(logging.DEBUG) and _click_sample_rate > 0 and random.random() < _click_sample_rate
+
+
+def _stop_listener():
+    if _listener is not None: _listener.stop()
+
+
+atexit.register(_stop_listener)
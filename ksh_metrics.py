@@ -0,0 +1,196 @@
+"""In-process metrics rendered in the Prometheus text exposition format (served on /metrics).
+
+Counters, gauges and histograms take their label values positionally, in labelnames
+order. Gauges can instead be given a function that is called at scrape time. Timed game
+calls are also observed from eventlet's thread pool (clicks run there), so every metric
+guards its updates and its rendering with a lock.
+"""
+import bisect
+import threading
+import time
+from functools import wraps
+
+# Seconds; tuned for work that should finish well inside one frame of the client.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'): return '+Inf'
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._sample_lines())
+        return '\n'.join(lines)
+
+    def _sample_lines(self):
+        raise NotImplementedError
+
+
+class _ValueMetric(Metric):
+    def __init__(self, name, help, labelnames=(), function=None):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+        self._function = function # returns {label values tuple: value}, read at scrape time
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _sample_lines(self):
+        if self._function:
+            values = self._function()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values.items()]
+
+
+class Counter(_ValueMetric):
+    type = 'counter'
+
+
+class Gauge(_ValueMetric):
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label values -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def _sample_lines(self):
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        lines = []
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, (('le', _format_value(bound)),))} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]!r}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics: raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, help, labelnames=(), function=None):
+    return REGISTRY.register(Counter(name, help, labelnames, function))
+
+
+def gauge(name, help, labelnames=(), function=None):
+    return REGISTRY.register(Gauge(name, help, labelnames, function))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+GAME_CALL_SECONDS = histogram('ksh_game_call_seconds', "Time spent in timed GameState calls of live games.", ('call',))
+
+# GameState attribute -> call label. get_piece_moves is where handle_click asks a piece
+# for its get_valid_moves.
+INSTRUMENTED_GAME_CALLS = {
+    'get_piece_moves': 'get_valid_moves',
+    'filter_legal_moves': 'filter_legal_moves',
+    'is_su_in_check': 'is_su_in_check',
+    'generate_fen': 'generate_fen',
+}
+
+
+def _timed_method(game, attr, histogram, *labels):
+    cls = type(game)
+
+    # The method is looked up on the class at each call, so wrappers installed there later
+    # (ksh_profiling) still run underneath.
+    @wraps(getattr(cls, attr))
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(cls, attr)(game, *args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start, *labels)
+    return wrapper
+
+
+def instrument_game(game):
+    """Times INSTRUMENTED_GAME_CALLS on this GameState only, by shadowing the methods on the
+    instance. Copies (the engine's search, replay views) do not inherit the wrappers."""
+    for attr, call in INSTRUMENTED_GAME_CALLS.items():
+        setattr(game, attr, _timed_method(game, attr, GAME_CALL_SECONDS, call))
+    return game
@@ -0,0 +1,210 @@
+"""Opt-in profiling of the GameState hot path: call counts and cumulative time per function.
+
+A game is profiled while a Profiler is attached to it, either for a block
+(with PROFILER.profiling(game): ...) or for the rest of its life (attach(), or
+sample_game() for a random share of new games). Only the games attached are measured;
+engine search copies and every other game run the same code unmeasured.
+
+The timing wrappers are installed on the classes only while at least one game is
+attached and removed again once none is, so with profiling off the hot path runs the
+original, unwrapped methods.
+"""
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from functools import wraps
+
+from ksh_game import GameState, Piece
+
+PROFILED_GAME_METHODS = (
+    'is_in_palace', 'is_valid_palace_diagonal_move', 'is_square_under_attack', 'parse_fen', 'generate_fen',
+)
+
+_lock = threading.Lock()
+_attached = 0 # games currently attached to any profiler
+_originals = [] # (class, attribute, original function) for the wrappers installed
+_pending_releases = [] # games collected while _lock was held, released by the next _settle()
+
+
+def _piece_classes():
+    classes, pending = [], [Piece]
+    while pending:
+        cls = pending.pop()
+        classes.append(cls)
+        pending.extend(cls.__subclasses__())
+    return classes
+
+
+def _record(profiler, name, start):
+    elapsed = time.perf_counter() - start
+    with profiler.lock:
+        entry = profiler.stats.get(name)
+        if entry is None:
+            entry = profiler.stats[name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+def _wrap_game_method(name, function):
+    @wraps(function)
+    def wrapper(self, *args, **kwargs):
+        profiler = self._profiler
+        if profiler is None:
+            return function(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            _record(profiler, name, start)
+    return wrapper
+
+
+def _wrap_get_valid_moves(name, function):
+    # Jang and Hu delegate to Su's and Cha's get_valid_moves; such a call is already timed
+    # by the piece's own wrapper, so it is only recorded for pieces of the class it was installed on.
+    @wraps(function)
+    def wrapper(self, board_state, game_state):
+        profiler = game_state._profiler
+        if profiler is None or type(self).get_valid_moves is not wrapper:
+            return function(self, board_state, game_state)
+        start = time.perf_counter()
+        try:
+            return function(self, board_state, game_state)
+        finally:
+            _record(profiler, name, start)
+    return wrapper
+
+
+def _install():
+    for attr in PROFILED_GAME_METHODS:
+        function = GameState.__dict__[attr]
+        _originals.append((GameState, attr, function))
+        setattr(GameState, attr, _wrap_game_method(f"GameState.{attr}", function))
+    for cls in _piece_classes():
+        function = cls.__dict__.get('get_valid_moves')
+        if function is None: continue
+        _originals.append((cls, 'get_valid_moves', function))
+        setattr(cls, 'get_valid_moves', _wrap_get_valid_moves(f"{cls.__name__}.get_valid_moves", function))
+
+
+def _uninstall():
+    while _originals:
+        cls, attr, function = _originals.pop()
+        setattr(cls, attr, function)
+
+
+def _settle():
+    """Applies queued releases, then installs or removes the wrappers to match _attached. Needs _lock."""
+    global _attached
+    while True:
+        while _pending_releases:
+            _pending_releases.pop()
+            _attached -= 1
+        if _attached and not _originals: _install()
+        elif not _attached and _originals: _uninstall()
+        else: return
+
+
+def _acquire():
+    global _attached
+    with _lock:
+        _attached += 1
+        _settle()
+
+
+def _release():
+    global _attached
+    with _lock:
+        _attached -= 1
+        _settle()
+
+
+def _release_collected():
+    """_release() for a game that was garbage collected.
+
+    Its finalizer can run on any allocation, including inside _acquire() or _release() on
+    this same thread, so it never waits for _lock: the release is queued and applied now
+    if the lock is free, otherwise by whoever holds it or the next attach or detach.
+    """
+    _pending_releases.append(None)
+    if _lock.acquire(blocking=False):
+        try:
+            _settle()
+        finally:
+            _lock.release()
+
+
+def profiling_active():
+    return _attached > 0
+
+
+class Profiler:
+    """Call counts and cumulative seconds (including nested profiled calls) per function.
+
+    Profiled games may run in eventlet's thread pool, so stats is only touched under lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {} # name -> [calls, seconds]
+        self._finalizers = {} # id(game) -> weakref.finalize releasing it
+
+    def attach(self, game):
+        """Profiles game until detach(), or until the game is garbage collected."""
+        if game._profiler is self: return
+        if game._profiler is not None: game._profiler.detach(game)
+        _acquire()
+        game._profiler = self
+        self._finalizers[id(game)] = weakref.finalize(game, self._collected, id(game))
+
+    def detach(self, game):
+        if game._profiler is not self: return
+        game._profiler = None
+        self._finalizers.pop(id(game)).detach()
+        _release()
+
+    def _collected(self, game_id):
+        self._finalizers.pop(game_id, None)
+        _release_collected()
+
+    @contextmanager
+    def profiling(self, game):
+        """Profiles game for the duration of the block (unless it was already attached)."""
+        attached = game._profiler is self
+        self.attach(game)
+        try:
+            yield self
+        finally:
+            if not attached: self.detach(game)
+
+    @property
+    def games(self):
+        return len(self._finalizers)
+
+    def top(self, limit=20, sort='seconds'):
+        """The most expensive functions first, by 'seconds', 'calls' or 'per_call'."""
+        with self.lock:
+            rows = [
+                {'function': name, 'calls': calls, 'seconds': seconds, 'per_call': seconds / calls}
+                for name, (calls, seconds) in self.stats.items()
+            ]
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+
+# The profiler that sampled games and the admin route share.
+PROFILER = Profiler()
+
+
+def sample_game(game, rate, profiler=PROFILER):
+    """Attaches profiler to game with probability rate. Returns True if it did."""
+    if rate > 0 and random.random() < rate:
+        profiler.attach(game)
+        return True
+    return False
@@ -0,0 +1,161 @@
+"""Client-facing state payloads.
+
+Rooms receive a full 'update_state' snapshot when a game is created or joined and
+whenever a client asks for a resync. Every other change goes out as a 'state_delta':
+
+    {"seq": 12,
+     "squares": [[y, x, cell or null], ...],   # only squares whose cell changed
+     "selected_pos": [y, x], "valid_moves": [...], ...}   # only top-level fields that changed
+
+seq increases by one per message sent to the room. A client that sees a gap should
+emit 'request_resync' and wait for the next 'update_state'.
+
+The snapshot board is encoded to JSON once per GameState.version and spliced into the
+outgoing packet by PayloadJSON, which the SocketIO server uses as its json module.
+"""
+import json
+import re
+
+# Top-level payload fields besides the board itself.
+STATE_FIELDS = (
+    'current_turn', 'game_over', 'winner', 'end_reason', 'valid_moves', 'deactivated_groups',
+    'in_check_team', 'checked_su_pos', 'selected_pos', 'fen',
+)
+
+
+def serialize_piece(piece, game_state):
+    return {
+        "team": piece.team, "name": piece.name,
+        "korean_name": piece.korean_name, "position": piece.position,
+        "is_deactivated": game_state.is_piece_deactivated(piece),
+    }
+
+
+def get_state_fields(game_state):
+    return {
+        "current_turn": game_state.current_turn,
+        "game_over": game_state.game_over,
+        "winner": game_state.winner,
+        "end_reason": game_state.end_reason,
+        "valid_moves": game_state.valid_moves,
+        "deactivated_groups": game_state.deactivated_groups,
+        "in_check_team": game_state.in_check_team,
+        "checked_su_pos": game_state.checked_su_pos,
+        "selected_pos": game_state.selected_pos,
+        "fen": game_state.generate_fen(),
+    }
+
+
+class RawJSON:
+    """Already-encoded JSON text that PayloadJSON.dumps inserts verbatim."""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+# json.dumps writes the placeholder "\x00<n>" for the n-th RawJSON value as "\u0000<n>".
+_RAW_PLACEHOLDER = re.compile(r'"\\u0000(\d+)"')
+
+
+class PayloadJSON:
+    """Drop-in for the json module (SocketIO(json=...)) that splices RawJSON values into the output."""
+    loads = staticmethod(json.loads)
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        raw = []
+
+        def default(value):
+            if isinstance(value, RawJSON):
+                raw.append(value.text)
+                return f"\x00{len(raw) - 1}"
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+        text = json.dumps(obj, default=default, **kwargs)
+        if not raw: return text
+        return _RAW_PLACEHOLDER.sub(lambda match: raw[int(match.group(1))], text)
+
+
+def encode_board(game_state):
+    """The snapshot's board_state: one serialize_piece dict (or null) per square, as compact JSON text."""
+    return json.dumps([
+        [serialize_piece(piece, game_state) if piece else None for piece in row]
+        for row in game_state.board_state
+    ], separators=(',', ':'))
+
+
+class StateTracker:
+    """Remembers what one room was last sent so the next update can be a delta."""
+
+    def __init__(self):
+        self.seq = 0
+        self._squares = None # bytes(game_state.squares) as last sent
+        self._fields = None
+        self._version = None # GameState.version the room last saw
+        self._board = (None, None) # (version, RawJSON board) reused until the position changes
+
+    def encoded_board(self, game_state):
+        version, board = self._board
+        if version != game_state.version:
+            board = RawJSON(encode_board(game_state))
+            self._board = (game_state.version, board)
+        return board
+
+    def snapshot(self, game_state, advance=True):
+        """Full 'update_state' payload. With advance=False (a resync for one client) the room baseline is kept."""
+        payload = {"board_state": self.encoded_board(game_state), **get_state_fields(game_state)}
+        if advance:
+            self.seq += 1
+            self._remember(game_state, payload)
+        payload['seq'] = self.seq
+        return payload
+
+    def update(self, game_state):
+        """Returns (event, payload) for the next room broadcast: a snapshot first, deltas afterwards."""
+        if self._squares is None:
+            return 'update_state', self.snapshot(game_state)
+        fields, previous = get_state_fields(game_state), self._fields
+        changed_fields = {key: value for key, value in fields.items() if previous[key] != value}
+        self.seq += 1
+        self._fields = self._copy_fields(fields)
+        if game_state.version == self._version:
+            # Selection-only change: the board is exactly what the room already has.
+            return 'state_delta', {'seq': self.seq, 'squares': [], **changed_fields}
+        squares = bytes(game_state.squares)
+        changed = {idx for idx, (before, after) in enumerate(zip(self._squares, squares)) if before != after}
+        if 'deactivated_groups' in changed_fields:
+            changed.update(self._group_squares(game_state, previous['deactivated_groups'], fields['deactivated_groups']))
+        width = game_state.BOARD_WIDTH_CELLS
+        cells = []
+        for idx in sorted(changed):
+            y, x = divmod(idx, width)
+            piece = game_state.board_state[y][x]
+            cells.append([y, x, serialize_piece(piece, game_state) if piece else None])
+        self._squares = squares
+        self._version = game_state.version
+        return 'state_delta', {'seq': self.seq, 'squares': cells, **changed_fields}
+
+    def _remember(self, game_state, payload):
+        self._version = game_state.version
+        self._squares = bytes(game_state.squares)
+        self._fields = self._copy_fields({key: payload[key] for key in STATE_FIELDS})
+
+    @staticmethod
+    def _copy_fields(fields):
+        fields = dict(fields)
+        fields['deactivated_groups'] = dict(fields['deactivated_groups'])
+        fields['valid_moves'] = list(fields['valid_moves'])
+        return fields
+
+    @staticmethod
+    def _group_squares(game_state, before, after):
+        """Squares whose is_deactivated flag may have flipped with the group change."""
+        flipped = {key for key in set(before) | set(after) if before.get(key, False) != after.get(key, False)}
+        width = game_state.BOARD_WIDTH_CELLS
+        indices = []
+        for y, row in enumerate(game_state.board_state):
+            for x, piece in enumerate(row):
+                if piece and f"{piece.team}_{piece.general_group}" in flipped:
+                    indices.append(y * width + x)
+        return indices
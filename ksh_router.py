@@ -0,0 +1,199 @@
+"""Front process of the sharded deployment: several app.py workers behind one endpoint.
+
+Each worker is an ordinary app.py process that owns the games whose game_id hashes to
+it (ksh_sessions.shard_of), so every game lives in exactly one process and the workers
+share no state. Clients connect here. For each client the router holds one Socket.IO
+connection (a relay) to the worker it is playing on and forwards events both ways;
+room broadcasts from a worker reach each player through that player's own relay.
+
+Routing: join_game goes to the worker that owns the game_id. create_game stays on the
+client's current worker or, for a client without one, goes to the next worker in turn.
+Anything else goes to the client's current worker. Moving a client to another worker
+closes its old relay, which frees its old seat there just as a disconnect would.
+
+The router itself is a single eventlet process that relays every event, so it is a
+ceiling of its own: the workers only add capacity while it has a core to itself and is
+not yet saturated. On one core (benchmarks/loadtest.py --workers N, 10-25 games) it tops
+out near 350 events/s, about half of what a lone app.py serves there, and a second
+worker does not help. Beyond what one process can relay, put several routers behind a
+load balancer; they share nothing but the workers.
+
+    python ksh_router.py
+
+starts KSH_WORKERS local workers (default: one per core) on the ports after KSH_PORT and
+serves clients on KSH_PORT. With KSH_WORKER_URLS (comma separated) it routes to workers
+started elsewhere instead; each must run with KSH_SHARD=<its index> and KSH_SHARDS=<count>.
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import atexit
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import socketio as socketio_client
+from eventlet.semaphore import Semaphore
+from flask import Flask, request
+from flask_socketio import SocketIO
+
+from ksh_logging import configure_logging, get_logger
+from ksh_sessions import shard_of
+
+configure_logging(os.environ.get('KSH_LOG_LEVEL', 'INFO'))
+logger = get_logger('router')
+
+app = Flask(__name__)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+
+WORKER_START_TIMEOUT = 30
+worker_urls = [] # shard index -> base URL
+_next_worker = itertools.count()
+
+
+class Relay:
+    """One client's connection to the worker it is playing on."""
+
+    def __init__(self, sid, shard):
+        self.sid = sid
+        self.shard = shard
+        self.closing = False
+        self.client = socketio_client.Client(reconnection=False)
+        self.client.on('*', self._forward)
+        self.client.on('disconnect', self._lost)
+
+    def open(self):
+        self.client.connect(worker_urls[self.shard])
+
+    def close(self):
+        self.closing = True
+        self.client.disconnect()
+
+    def emit(self, event, data):
+        self.client.emit(event, data)
+
+    def _forward(self, event, data=None):
+        socketio.emit(event, data, to=self.sid)
+
+    def _lost(self, *args):
+        if self.closing: return
+        route = routes.get(self.sid)
+        if route is not None and route.relay is self:
+            route.relay = None
+        logger.warning("worker connection lost", extra={'fields': {'sid': self.sid, 'shard': self.shard}})
+        socketio.emit('error', {'message': '게임 서버와의 연결이 끊어졌습니다.'}, to=self.sid)
+
+
+class Route:
+    """A connected client: its relay, and a lock that keeps its events in order while a
+    relay is being (re)opened."""
+    __slots__ = ('lock', 'relay')
+
+    def __init__(self):
+        self.lock = Semaphore()
+        self.relay = None
+
+
+routes = {} # client sid -> Route
+
+
+def target_shard(event, data, route):
+    if event == 'join_game' and isinstance(data, dict) and isinstance(data.get('game_id'), str):
+        return shard_of(data['game_id'], len(worker_urls))
+    if route.relay is not None:
+        return route.relay.shard
+    return next(_next_worker) % len(worker_urls)
+
+
+@app.route('/')
+def index():
+    return f"KSH Game Router is running. Workers: {len(worker_urls)}, clients: {len(routes)}"
+
+
+@socketio.on('connect')
+def on_connect(auth=None):
+    routes[request.sid] = Route()
+
+
+@socketio.on('disconnect')
+def on_disconnect(reason=None):
+    route = routes.pop(request.sid, None)
+    if route is not None and route.relay is not None:
+        route.relay.close()
+
+
+@socketio.on('*')
+def on_event(event, data=None):
+    sid = request.sid
+    route = routes.get(sid)
+    if route is None: return
+    with route.lock:
+        shard = target_shard(event, data, route)
+        if route.relay is None or route.relay.shard != shard:
+            if route.relay is not None:
+                route.relay.close()
+                route.relay = None
+            relay = Relay(sid, shard)
+            try:
+                relay.open()
+            except socketio_client.exceptions.ConnectionError as e:
+                logger.error("worker unreachable", extra={'fields': {'shard': shard, 'url': worker_urls[shard], 'error': str(e)}})
+                socketio.emit('error', {'message': '게임 서버에 연결할 수 없습니다.'}, to=sid)
+                return
+            route.relay = relay
+        route.relay.emit(event, data)
+
+
+def _wait_for_port(host, port, process):
+    deadline = time.monotonic() + WORKER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"worker on port {port} exited with status {process.returncode}")
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"worker on port {port} did not start within {WORKER_START_TIMEOUT}s")
+
+
+def _stop_workers(processes):
+    for process in processes:
+        if process.poll() is None: process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def start_workers(count, base_port, host='127.0.0.1'):
+    """Starts count app.py workers on base_port, base_port + 1, ... Returns their URLs."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    processes = []
+    atexit.register(_stop_workers, processes)
+    for index in range(count):
+        env = dict(os.environ, KSH_SHARD=str(index), KSH_SHARDS=str(count), KSH_HOST=host, KSH_PORT=str(base_port + index))
+        processes.append(subprocess.Popen([sys.executable, script], env=env))
+    for index, process in enumerate(processes):
+        _wait_for_port(host, base_port + index, process)
+    logger.info("workers started", extra={'fields': {'workers': count, 'base_port': base_port}})
+    return [f"http://{host}:{base_port + index}" for index in range(count)]
+
+
+def main():
+    port = int(os.environ.get('KSH_PORT', 5000))
+    if os.environ.get('KSH_WORKER_URLS'):
+        worker_urls.extend(url.strip() for url in os.environ['KSH_WORKER_URLS'].split(',') if url.strip())
+    else:
+        count = int(os.environ.get('KSH_WORKERS', os.cpu_count() or 1))
+        worker_urls.extend(start_workers(count, int(os.environ.get('KSH_WORKER_BASE_PORT', port + 1))))
+    logger.info("starting KSH game router", extra={'fields': {'port': port, 'workers': len(worker_urls)}})
+    socketio.run(app, host=os.environ.get('KSH_HOST', '0.0.0.0'), port=port)
+
+
+if __name__ == '__main__':
+    main()
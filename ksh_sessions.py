@@ -0,0 +1,245 @@
+"""Live game sessions, indexed both by game_id and by the sid sitting in each seat.
+
+A session is the dict app.py keeps per game ('game', 'players', ...). The registry owns
+session['players'] for human seats and mirrors every seat in a sid -> (game_id, team)
+index, so finding a player's game on a click or a disconnect never scans the sessions.
+Seats taken by something other than a connection (the AI) are written straight into
+session['players'] and are not indexed.
+
+Sessions are also kept in least-recently-active order. reap() drops sessions idle past
+the TTL of their phase (waiting for an opponent, playing, finished) and then evicts the
+least recently active ones until the game-count and estimated-memory caps hold.
+
+With a loader, a game_id that is not in memory is handed to loader(game_id), which may
+return a session restored from storage (with no human seats taken) or None.
+
+In a sharded deployment (ksh_router) each worker's registry is given its shard: it only
+mints game_ids that shard_of() maps to it, and never loads anyone else's.
+"""
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+# Rough per-session footprint (GameState, StateTracker and its cached board) and the cost
+# of one move_history entry, measured with tracemalloc. Only used against max_bytes.
+SESSION_BASE_BYTES = 27_000
+PLY_BYTES = 240
+
+PHASES = ('waiting', 'playing', 'finished')
+TEAMS = ('초', '한')
+
+
+class SessionError(Exception):
+    """A create/join request that cannot be honoured."""
+
+
+class GameNotFound(SessionError):
+    pass
+
+
+class SeatTaken(SessionError):
+    pass
+
+
+class AlreadySeated(SessionError):
+    """The sid already holds a seat in this game."""
+
+
+def session_phase(session):
+    game = session['game']
+    if game.game_over: return 'finished'
+    if not game.move_history and None in session['players'].values(): return 'waiting'
+    return 'playing'
+
+
+def shard_of(game_id, shards):
+    """The shard (0 .. shards - 1) that owns game_id; stable across processes and restarts."""
+    return zlib.crc32(game_id.encode()) % shards
+
+
+def estimate_session_bytes(session):
+    return SESSION_BASE_BYTES + PLY_BYTES * len(session['game'].move_history)
+
+
+class SessionRegistry:
+    """ttls maps each phase to its idle timeout in seconds; a missing or None entry never expires.
+    max_games and max_bytes (None for no cap) bound the store through LRU eviction.
+    shard is (index, count) when the registry owns only that shard of the game_ids."""
+
+    def __init__(self, ttls=None, max_games=None, max_bytes=None, loader=None, shard=(0, 1)):
+        self._sessions = {} # game_id -> session
+        self._seats = {} # sid -> (game_id, team)
+        self._activity = OrderedDict() # game_id -> last activity (time.monotonic()), oldest first
+        self._sizes = {} # game_id -> estimate_session_bytes at the last touch
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.ttls = {phase: (ttls or {}).get(phase) for phase in PHASES}
+        self.max_games = max_games
+        self.max_bytes = max_bytes
+        self.evictions = {**{f"idle_{phase}": 0 for phase in PHASES}, 'capacity': 0}
+        self.loader = loader
+        self.shard = shard
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, game_id):
+        return game_id in self._sessions
+
+    def get(self, game_id):
+        session = self._sessions.get(game_id)
+        if session is None and self.loader is not None:
+            with self._lock:
+                session = self._load(game_id)
+        return session
+
+    def _load(self, game_id):
+        session = self._sessions.get(game_id)
+        if session is None and self.loader is not None and game_id is not None and self.owns(game_id):
+            session = self.loader(game_id)
+            if session is not None:
+                self._sessions[game_id] = session
+                self._touch(game_id)
+        return session
+
+    def owns(self, game_id):
+        index, count = self.shard
+        return count == 1 or (isinstance(game_id, str) and shard_of(game_id, count) == index)
+
+    def sessions(self):
+        """A list of the (game_id, session) pairs in memory."""
+        return list(self._sessions.items())
+
+    def seat_of(self, sid):
+        """(game_id, team) for the sid's seat, or None."""
+        return self._seats.get(sid)
+
+    def team_of(self, sid, game_id):
+        seat = self._seats.get(sid)
+        return seat[1] if seat and seat[0] == game_id else None
+
+    def create(self, session, sid, team, claim=None):
+        """Registers session under a fresh game_id with sid seated as team.
+
+        claim(game_id), if given, is asked last about each candidate id and returns whether
+        it may be taken; app.py uses it to save the game, so an id that is only in storage
+        (a reaped or not yet loaded game) is never reused.
+
+        Returns (game_id, vacated): a seat the sid held elsewhere is released on the way,
+        and handed back as leave() would return it.
+        """
+        with self._lock:
+            game_id = uuid.uuid4().hex[:6]
+            while game_id in self._sessions or not self.owns(game_id) or (claim is not None and not claim(game_id)):
+                game_id = uuid.uuid4().hex[:6]
+            vacated = self._vacate(sid)
+            session['players'][team] = sid
+            self._sessions[game_id] = session
+            self._seats[sid] = (game_id, team)
+            self._touch(game_id)
+            return game_id, vacated
+
+    def join(self, game_id, sid):
+        """Seats sid in the first free seat of game_id. Returns (session, team, vacated), vacated as for create()."""
+        with self._lock:
+            session = self._load(game_id)
+            if session is None:
+                raise GameNotFound(game_id)
+            team = next((team for team in TEAMS if session['players'].get(team) is None), None)
+            if team is None:
+                raise SeatTaken(game_id)
+            if self._seats.get(sid, (None,))[0] == game_id:
+                raise AlreadySeated(sid)
+            vacated = self._vacate(sid)
+            session['players'][team] = sid
+            self._seats[sid] = (game_id, team)
+            self._touch(game_id)
+            return session, team, vacated
+
+    def leave(self, sid):
+        """Frees the sid's seat. Returns (game_id, team, session), or None if it had no seat."""
+        with self._lock:
+            return self._vacate(sid)
+
+    def _vacate(self, sid):
+        seat = self._seats.pop(sid, None)
+        if seat is None:
+            return None
+        game_id, team = seat
+        session = self._sessions[game_id]
+        session['players'][team] = None
+        return game_id, team, session
+
+    def remove(self, game_id):
+        """Drops a session and every seat still indexed for it. Returns the session, or None."""
+        with self._lock:
+            return self._remove(game_id)
+
+    def _remove(self, game_id):
+        session = self._sessions.pop(game_id, None)
+        if session is None:
+            return None
+        for sid in session['players'].values():
+            if self._seats.get(sid, (None,))[0] == game_id:
+                del self._seats[sid]
+        del self._activity[game_id]
+        self._total_bytes -= self._sizes.pop(game_id)
+        return session
+
+    def touch(self, game_id):
+        """Marks the game as just active (a click, a move) and refreshes its size estimate."""
+        with self._lock:
+            if game_id in self._sessions:
+                self._touch(game_id)
+
+    def _touch(self, game_id):
+        self._activity[game_id] = time.monotonic()
+        self._activity.move_to_end(game_id)
+        size = estimate_session_bytes(self._sessions[game_id])
+        self._total_bytes += size - self._sizes.get(game_id, 0)
+        self._sizes[game_id] = size
+
+    def reap(self, now=None):
+        """Evicts idle sessions, then enforces the caps. Returns [(game_id, session, reason)]."""
+        now = time.monotonic() if now is None else now
+        evicted = []
+        with self._lock:
+            ttls = [ttl for ttl in self.ttls.values() if ttl is not None]
+            if ttls:
+                shortest = min(ttls)
+                for game_id, last_active in list(self._activity.items()):
+                    idle = now - last_active
+                    if idle < shortest: break # everything after this is more recent
+                    phase = session_phase(self._sessions[game_id])
+                    ttl = self.ttls[phase]
+                    if ttl is not None and idle >= ttl:
+                        evicted.append(self._evict(game_id, f"idle_{phase}"))
+            evicted.extend(self._enforce_caps())
+        return evicted
+
+    def enforce_caps(self):
+        """Evicts least recently active sessions until max_games and max_bytes hold."""
+        with self._lock:
+            return self._enforce_caps()
+
+    def _enforce_caps(self):
+        evicted = []
+        while self._activity and (
+                (self.max_games is not None and len(self._sessions) > self.max_games)
+                or (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+            evicted.append(self._evict(next(iter(self._activity)), 'capacity'))
+        return evicted
+
+    def _evict(self, game_id, reason):
+        self.evictions[reason] += 1
+        return game_id, self._remove(game_id), reason
+
+    def stats(self):
+        return {
+            'games': len(self._sessions),
+            'seats': len(self._seats),
+            'estimated_bytes': self._total_bytes,
+            'evictions': dict(self.evictions),
+        }
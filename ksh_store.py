@@ -0,0 +1,146 @@
+"""Durable game storage, so in-flight games survive a restart of the server.
+
+Each game has an append-only move log and a compact snapshot (GameState.to_snapshot)
+rewritten every SNAPSHOT_INTERVAL plies and when the game ends. The log keeps each move
+packed as MoveHistory stores it, and the history's keyframes are saved with the snapshot.
+Loading a game restores the latest snapshot for the board, rebuilds move_history up to it
+from the packed log, and replays only the moves logged after it, so takeback and replay
+reach back to the first move. Nothing is read at startup: app.py loads a game the first
+time its game_id is asked for.
+
+GameStore is the interface and also the do-nothing store used when persistence is off.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from ksh_game import GameState, MoveHistory
+
+SNAPSHOT_INTERVAL = 20
+
+
+class GameStore:
+    def create_game(self, game_id, game, vs_ai):
+        """Saves a new game. Returns False, leaving the store untouched, if game_id is already saved."""
+        return True
+
+    def record_move(self, game_id, game):
+        """Logs the move that game.move_history[-1] records."""
+
+    def record_undo(self, game_id, game, count):
+        """Drops the last count logged moves, which game.undo() has just taken back."""
+
+    def load_game(self, game_id):
+        """Returns (game, vs_ai) for a saved game, or None."""
+        return None
+
+    def delete_game(self, game_id):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteGameStore(GameStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (
+            game_id TEXT PRIMARY KEY,
+            vs_ai INTEGER NOT NULL,
+            plies INTEGER NOT NULL,
+            snapshot TEXT NOT NULL,
+            snapshot_ply INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            keyframes TEXT NOT NULL DEFAULT '[]'
+        );
+        CREATE TABLE IF NOT EXISTS moves (
+            game_id TEXT NOT NULL,
+            ply INTEGER NOT NULL,
+            from_y INTEGER NOT NULL, from_x INTEGER NOT NULL,
+            to_y INTEGER NOT NULL, to_x INTEGER NOT NULL,
+            packed INTEGER,
+            PRIMARY KEY (game_id, ply)
+        ) WITHOUT ROWID;
+    """
+    # Columns added after the first schema; databases created before them gain them on open.
+    ADDED_COLUMNS = (
+        ('games', 'keyframes', "TEXT NOT NULL DEFAULT '[]'"),
+        ('moves', 'packed', 'INTEGER'),
+    )
+
+    def __init__(self, path, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+        for table, column, definition in self.ADDED_COLUMNS:
+            if column not in {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}:
+                self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def create_game(self, game_id, game, vs_ai):
+        try:
+            with self._lock, self._db:
+                self._db.execute(
+                    "INSERT INTO games VALUES (?, ?, 0, ?, 0, ?, '[]')",
+                    (game_id, int(vs_ai), json.dumps(game.to_snapshot()), time.time()))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def record_move(self, game_id, game):
+        history = game.move_history
+        move = history[-1]
+        (from_y, from_x), (to_y, to_x) = move.from_pos, move.to_pos
+        with self._lock, self._db:
+            row = self._db.execute("SELECT plies FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None: return
+            ply = row[0] + 1
+            self._db.execute("INSERT INTO moves VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (game_id, ply, from_y, from_x, to_y, to_x, history.packed(len(history) - 1)))
+            if ply % self.snapshot_interval == 0 or game.game_over:
+                self._write_snapshot(game_id, game, ply)
+            else:
+                self._db.execute("UPDATE games SET plies = ?, updated_at = ? WHERE game_id = ?", (ply, time.time(), game_id))
+
+    def record_undo(self, game_id, game, count):
+        with self._lock, self._db:
+            row = self._db.execute("SELECT plies FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None: return
+            ply = max(row[0] - count, 0)
+            self._db.execute("DELETE FROM moves WHERE game_id = ? AND ply > ?", (game_id, ply))
+            # The last snapshot may be past the new end of the log, so take one here.
+            self._write_snapshot(game_id, game, ply)
+
+    def _write_snapshot(self, game_id, game, ply):
+        self._db.execute(
+            "UPDATE games SET plies = ?, snapshot = ?, snapshot_ply = ?, keyframes = ?, updated_at = ? WHERE game_id = ?",
+            (ply, json.dumps(game.to_snapshot()), ply, json.dumps(game.move_history.keyframes), time.time(), game_id))
+
+    def load_game(self, game_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT vs_ai, snapshot, snapshot_ply, keyframes FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None: return None
+            vs_ai, snapshot, snapshot_ply, keyframes = row
+            moves = self._db.execute(
+                "SELECT ply, from_y, from_x, to_y, to_x, packed FROM moves WHERE game_id = ? ORDER BY ply",
+                (game_id,)).fetchall()
+        game = GameState.from_snapshot(json.loads(snapshot))
+        logged = [move for move in moves if move[0] <= snapshot_ply]
+        # Games saved before moves were logged packed only get the history after the snapshot.
+        if all(move[5] is not None for move in logged):
+            game.move_history = MoveHistory.restore((move[5] for move in logged), json.loads(keyframes))
+        for _, from_y, from_x, to_y, to_x, _ in moves[len(logged):]:
+            game.move_piece((from_y, from_x), (to_y, to_x))
+        return game, bool(vs_ai)
+
+    def delete_game(self, game_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM moves WHERE game_id = ?", (game_id,))
+            self._db.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,89 @@
+"""Board zones: the palaces, the inner and outer areas, and the palace diagonals.
+
+The rectangles below are the source of truth. At import they are flattened into one
+bitmask byte per square and team (index y * BOARD_WIDTH_CELLS + x), so asking whether
+a square lies in a zone is a single lookup and a mask test.
+"""
+BOARD_WIDTH_CELLS = 15
+BOARD_HEIGHT_CELLS = 14
+TEAMS = ('초', '한')
+
+PALACES = {
+    '한': (1, 6, 3, 8), '초': (10, 6, 12, 8),
+    '한_좌': (1, 0, 3, 2), '한_우': (1, 12, 3, 14),
+    '초_좌': (10, 0, 12, 2), '초_우': (10, 12, 12, 14),
+}
+PALACE_DIAGONAL_PATHS = {
+    '한': [((1,6),(2,7)),((2,7),(3,8)),((2,7),(1,6)),((3,8),(2,7)),((1,8),(2,7)),((2,7),(3,6)),((2,7),(1,8)),((3,6),(2,7))],
+    '초': [((10,6),(11,7)),((11,7),(12,8)),((11,7),(10,6)),((12,8),(11,7)),((10,8),(11,7)),((11,7),(12,6)),((11,7),(10,8)),((12,6),(11,7))],
+    '한_좌': [((1,0),(2,1)),((2,1),(3,2)),((2,1),(1,0)),((3,2),(2,1)),((1,2),(2,1)),((2,1),(3,0)),((2,1),(1,2)),((3,0),(2,1))],
+    '한_우': [((1,12),(2,13)),((2,13),(3,14)),((2,13),(1,12)),((3,14),(2,13)),((1,14),(2,13)),((2,13),(3,12)),((2,13),(1,14)),((3,12),(2,13))],
+    '초_좌': [((10,0),(11,1)),((11,1),(12,2)),((11,1),(10,0)),((12,2),(11,1)),((10,2),(11,1)),((11,1),(12,0)),((11,1),(10,2)),((12,0),(11,1))],
+    '초_우': [((10,12),(11,13)),((11,13),(12,14)),((11,13),(10,12)),((12,14),(11,13)),((10,14),(11,13)),((11,13),(12,12)),((11,13),(10,14)),((12,12),(11,13))],
+}
+INNER_AREA = {'한': (1, 4, 3, 10), '초': (10, 4, 12, 10)}
+OUTER_AREA_BOUNDS = {'한': (0, 3, 4, 11), '초': (9, 3, 13, 11)}
+
+SIDE_PALACE_KEYS = ('초_좌', '초_우', '한_좌', '한_우')
+
+# Zone bits of a team's table.
+MAIN_PALACE = 1
+SIDE_PALACE = 2 # the team's '_좌' or '_우' palace
+PALACE = MAIN_PALACE | SIDE_PALACE
+INNER = 4
+OUTER = 8 # inside OUTER_AREA_BOUNDS but not in the inner area
+OUTER_OUTER = 16 # anywhere else on the board, outside the main palace
+
+
+def _in_rect(y, x, rect):
+    y1, x1, y2, x2 = rect
+    return y1 <= y <= y2 and x1 <= x <= x2
+
+
+def _zone_bits(y, x, team):
+    bits = 0
+    if _in_rect(y, x, PALACES[team]): bits |= MAIN_PALACE
+    if _in_rect(y, x, PALACES[f"{team}_좌"]) or _in_rect(y, x, PALACES[f"{team}_우"]): bits |= SIDE_PALACE
+    if _in_rect(y, x, INNER_AREA[team]): bits |= INNER
+    elif _in_rect(y, x, OUTER_AREA_BOUNDS[team]): bits |= OUTER
+    elif not bits & MAIN_PALACE: bits |= OUTER_OUTER
+    return bits
+
+
+def _square_index(y, x):
+    return y * BOARD_WIDTH_CELLS + x
+
+
+# team -> bytearray of zone bits per square.
+ZONES = {
+    team: bytearray(_zone_bits(y, x, team) for y in range(BOARD_HEIGHT_CELLS) for x in range(BOARD_WIDTH_CELLS))
+    for team in TEAMS
+}
+# The key of the palace each square lies in, or None. Palaces do not overlap.
+PALACE_AT = [
+    next((key for key, rect in PALACES.items() if _in_rect(y, x, rect)), None)
+    for y in range(BOARD_HEIGHT_CELLS) for x in range(BOARD_WIDTH_CELLS)
+]
+# Every one-square step along a palace diagonal, as from_index << 8 | to_index.
+PALACE_DIAGONAL_STEPS = frozenset(
+    _square_index(*start) << 8 | _square_index(*end)
+    for segments in PALACE_DIAGONAL_PATHS.values() for start, end in segments
+)
+
+
+def in_zone(y, x, team, mask):
+    """True if (y, x) is on the board and in any of the zones of team that mask selects."""
+    return 0 <= y < BOARD_HEIGHT_CELLS and 0 <= x < BOARD_WIDTH_CELLS and bool(ZONES[team][y * BOARD_WIDTH_CELLS + x] & mask)
+
+
+def palace_at(y, x):
+    """The key of the palace containing (y, x), or None (also off the board)."""
+    if 0 <= y < BOARD_HEIGHT_CELLS and 0 <= x < BOARD_WIDTH_CELLS:
+        return PALACE_AT[y * BOARD_WIDTH_CELLS + x]
+    return None
+
+
+def is_palace_diagonal_step(y1, x1, y2, x2):
+    """True if (y1, x1) -> (y2, x2) is one step along a palace diagonal."""
+    if not (0 <= y2 < BOARD_HEIGHT_CELLS and 0 <= x2 < BOARD_WIDTH_CELLS): return False
+    return ((y1 * BOARD_WIDTH_CELLS + x1) << 8 | (y2 * BOARD_WIDTH_CELLS + x2)) in PALACE_DIAGONAL_STEPS
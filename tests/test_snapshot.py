@@ -0,0 +1,29 @@
+import json
+
+from ksh_game import GameState
+
+# 한 to move, with (10, 2) -> (10, 6) mating 초; reached from the start position by play.
+BEFORE_MATE = {
+    'fen': "3M3B3M2R/RA3EA1AE2EA1/5L7Q1/2Q2NCK3L2N/E1NU1R5U3/P1PG1GGFgP4G/1PC7P2GG/g3p1c8/g2g1p1pg2gppp/7f3u3/nqR3e1k3C1n/la2r3a4q1/r1e2ea3nlCar/3m2b4mc2"
+           "|3-3-3-2m/--3--1--2--1/5m7-1/2m2--m3m2-/m1m-1m5-3/-1-m1--mm-4-/1mm7m2mm/m3m1m8/-2m1-1mm2m---/7-3-3/-mm3m1m3m1-/mm2m3m4-1/-1-2--3mmm--/3-2m4-m2"
+           "|3L3C3R2R/LL3CC1CC2RR1/5L7R1/2L2CCC3R2R/L1LL1C5R3/L1LC1CCCCC4R/1LL7C2RR/L3C1C8/L2L1C1CC2CRRR/7C3R3/LLC3C1C3C1R/LL2C3C4R1/L1L2CC3CRRRR/3L2C4RR2",
+    'captured_groups': [],
+    'turn': '한',
+    'deactivated_groups': {'초_좌': False, '초_우': False, '한_좌': False, '한_우': False},
+    'game_over': False,
+    'winner': None,
+    'end_reason': None,
+}
+
+
+def test_checkmated_game_round_trips():
+    game = GameState.from_snapshot(BEFORE_MATE)
+    game.move_piece((10, 2), (10, 6))
+    assert (game.game_over, game.winner, game.end_reason) == (True, '한', 'checkmate')
+    assert game.in_check_team == '초' and game.checked_su_pos is not None
+
+    restored = GameState.from_snapshot(json.loads(json.dumps(game.to_snapshot())))
+    assert restored.generate_fen() == game.generate_fen()
+    assert (restored.game_over, restored.winner, restored.end_reason) == (True, '한', 'checkmate')
+    assert (restored.in_check_team, restored.checked_su_pos) == (game.in_check_team, game.checked_su_pos)
+    assert restored.zobrist_key == game.zobrist_key